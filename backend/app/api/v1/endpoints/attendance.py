@@ -1,43 +1,33 @@
+import asyncio
 from fastapi import APIRouter, HTTPException, Depends
 from typing import Dict, Any
 from app.api.v1.endpoints.auth.google import verify_supabase_token
-from app.tools.attendance_tools_supabase import get_attendance_summary
+from app.core.supabase_client import supabase
+from app.core.users import get_user_id
+from app.models.schemas import MarkAttendanceRequest
+from app.tools.attendance_tools_supabase import mark_attendance
 
 router = APIRouter()
 
 @router.post("/mark")
 async def mark_attendance_endpoint(
-    request: Dict[str, str],
+    request: MarkAttendanceRequest,
     user: Dict[str, Any] = Depends(verify_supabase_token)
 ):
     """
     Mark attendance for a course.
     """
     try:
-        course_name = request.get('course_name')
-        if not course_name:
-            raise HTTPException(status_code=400, detail="course_name is required")
+        course_name = request.course_name
 
         # Get user's internal ID from Google ID
-        from app.core.supabase_client import supabase
-        user_data = supabase.table('users').select('id').eq('google_id', user["google_id"]).single()
-        
-        # Handle both dictionary and object response formats
-        if isinstance(user_data, dict):
-            user_info = user_data.get('data')
-        elif hasattr(user_data, 'data'):
-            user_info = user_data.data
-        else:
-            user_info = None
-            
-        if not user_info:
+        try:
+            user_id = await get_user_id(user["google_id"])
+        except ValueError:
             raise HTTPException(status_code=404, detail="User not found")
 
-        user_id = user_info['id']
-
-        # Mark attendance using the tool
-        from app.tools.attendance_tools_supabase import mark_attendance
-        result = mark_attendance(course_name, str(user_id))
+        # Mark attendance using the tool; it does blocking DB I/O
+        result = await asyncio.to_thread(mark_attendance, course_name, str(user_id))
 
         if not result['success']:
             raise HTTPException(status_code=500, detail=result['error'])
@@ -58,32 +48,13 @@ async def get_attendance_stats(user: Dict[str, Any] = Depends(verify_supabase_to
     Get attendance statistics for the user.
     """
     try:
-        # Get user's internal ID from Google ID
-        from app.core.supabase_client import supabase
-        user_data = supabase.table('users').select('id').eq('google_id', user["google_id"]).single()
-        
-        # Handle both dictionary and object response formats
-        if isinstance(user_data, dict):
-            user_info = user_data.get('data')
-        elif hasattr(user_data, 'data'):
-            user_info = user_data.data
-        else:
-            user_info = None
-            
-        if not user_info:
+        # User lookup and all aggregation happen server-side in one RPC
+        stats = await supabase.rpc('get_user_attendance_stats', {'p_google_id': user["google_id"]}).execute()
+        if stats is None:
             raise HTTPException(status_code=404, detail="User not found")
 
-        user_id = user_info['id']
-
-        # Get attendance summary
-        summary_result = get_attendance_summary(str(user_id))
-
-        if not summary_result['success']:
-            raise HTTPException(status_code=500, detail=summary_result['error'])
-
-        # Calculate overall stats
-        total_attendance = sum(course['total_attendance'] for course in summary_result['summary'])
-        total_courses = len(summary_result['summary'])
+        total_attendance = stats['total_attendance']
+        total_courses = stats['total_courses']
 
         # For demo purposes, assume 15 classes per course for percentage calculation
         # In a real app, this would be configurable per course
@@ -95,7 +66,7 @@ async def get_attendance_stats(user: Dict[str, Any] = Depends(verify_supabase_to
             "total_attendance": total_attendance,
             "total_courses": total_courses,
             "attendance_percentage": round(attendance_percentage, 1),
-            "courses": summary_result['summary']
+            "courses": stats['courses']
         }
 
     except HTTPException:
@@ -1,12 +1,136 @@
 from typing import Dict, Any, Optional
-import os
+import time
+import asyncio
+import hashlib
+import secrets
+import datetime
+from urllib.parse import urlencode
 import jwt
+import httpx
+from cachetools import TLRUCache
 from fastapi import APIRouter, HTTPException, Header, Depends
 from app.core.config import settings
 from app.core.db_client import get_user_by_google_id, create_user
+from app.core.supabase_client import supabase
+from app.tools.email_tools import _oauth_states, token_store
 
 router = APIRouter()
 
+# Google OAuth configuration doesn't change at runtime; resolve it once
+_GOOGLE_CLIENT_ID = settings.GOOGLE_CLIENT_ID
+_GOOGLE_CLIENT_SECRET = settings.GOOGLE_CLIENT_SECRET
+_GOOGLE_TOKEN_URL = "https://oauth2.googleapis.com/token"
+_REDIRECT_URI = f"{settings.FRONTEND_URL}/auth/google/callback"
+
+# 32 random bytes -> 43-char URL-safe state token
+_OAUTH_STATE_NBYTES = 32
+
+# Everything in the consent URL except the per-request state parameter
+_GOOGLE_AUTH_URL_PREFIX = "https://accounts.google.com/o/oauth2/v2/auth?" + urlencode({
+    "client_id": _GOOGLE_CLIENT_ID,
+    "redirect_uri": _REDIRECT_URI,
+    "scope": "https://www.googleapis.com/auth/gmail.readonly https://www.googleapis.com/auth/gmail.compose https://www.googleapis.com/auth/spreadsheets",
+    "response_type": "code",
+    "access_type": "offline",
+    "prompt": "consent"
+})
+
+# Shared async HTTP client so Google token exchanges don't block the event loop
+# and reuse pooled TLS connections to oauth2.googleapis.com
+_http_client = httpx.AsyncClient(timeout=10.0)
+
+@router.on_event("shutdown")
+async def _close_http_client():
+    await _http_client.aclose()
+
+# Supabase projects using asymmetric JWT signing keys publish them here. The key set
+# is kept for 10 minutes, so verification normally needs no network call.
+_JWKS_URL = f"{settings.SUPABASE_URL}/auth/v1/.well-known/jwks.json"
+_JWKS_LIFESPAN = 600
+_JWKS_FETCH_TIMEOUT = 5.0
+# A token with an unknown kid may trigger a refetch at most this often; any other
+# unknown kid is rejected without a network call
+_JWKS_MIN_REFETCH_INTERVAL = 30
+
+# kid -> signing key. The lock ensures a single fetch at a time; concurrent misses
+# wait for it rather than each fetching the key set.
+_jwks_keys: Dict[str, jwt.PyJWK] = {}
+_jwks_fetched_at = 0.0
+_jwks_attempted_at = float("-inf")
+_jwks_lock = asyncio.Lock()
+
+async def _refresh_jwks():
+    global _jwks_keys, _jwks_fetched_at
+    response = await _http_client.get(_JWKS_URL, timeout=_JWKS_FETCH_TIMEOUT)
+    response.raise_for_status()
+    jwk_set = jwt.PyJWKSet.from_dict(response.json())
+    _jwks_keys = {key.key_id: key for key in jwk_set.keys if key.key_id}
+    _jwks_fetched_at = time.monotonic()
+
+async def _get_signing_key(kid: Optional[str]) -> jwt.PyJWK:
+    """Return the signing key for a kid, refetching the key set only when stale or rate limits allow."""
+    global _jwks_attempted_at
+    if not kid:
+        raise jwt.InvalidTokenError("Token header has no kid")
+
+    key = _jwks_keys.get(kid)
+    if key is not None and time.monotonic() - _jwks_fetched_at < _JWKS_LIFESPAN:
+        return key
+
+    async with _jwks_lock:
+        now = time.monotonic()
+        key = _jwks_keys.get(kid)
+        if key is not None and now - _jwks_fetched_at < _JWKS_LIFESPAN:
+            # Another request refreshed the key set while this one waited
+            return key
+
+        if now - _jwks_attempted_at >= _JWKS_MIN_REFETCH_INTERVAL:
+            _jwks_attempted_at = now
+            try:
+                await _refresh_jwks()
+            except (httpx.HTTPError, jwt.PyJWTError, ValueError) as e:
+                # Keep serving the previous keys; the next attempt waits out the interval
+                print(f"JWKS refresh failed: {e}")
+            key = _jwks_keys.get(kid)
+
+    if key is None:
+        raise jwt.InvalidTokenError("Unknown signing key")
+    return key
+
+# Verified JWT claims keyed by a digest of the token, so repeat requests with the
+# same token skip signature verification. Entries live for at most 5 minutes and
+# never past the token's own exp.
+def _claims_ttu(_key, claims, now):
+    return min(now + 300, claims.get("exp", now + 300))
+
+_token_cache = TLRUCache(maxsize=50_000, ttu=_claims_ttu, timer=time.time)
+
+async def _decode_token(token: str) -> Dict[str, Any]:
+    """Verify and decode a Supabase JWT, reusing cached claims while the token is still valid."""
+    key = hashlib.blake2b(token.encode(), digest_size=16).digest()
+    payload = _token_cache.get(key)
+    if payload is None:
+        header = jwt.get_unverified_header(token)
+        if header.get("alg") == "HS256":
+            # Legacy shared-secret signing
+            if not settings.SUPABASE_JWT_SECRET:
+                raise HTTPException(status_code=500, detail="SUPABASE_JWT_SECRET is not configured")
+            signing_key = settings.SUPABASE_JWT_SECRET
+            algorithms = ["HS256"]
+        else:
+            # Asymmetric signing keys; the JWKS is fetched only when stale or on a rate-limited kid miss
+            signing_key = (await _get_signing_key(header.get("kid"))).key
+            algorithms = ["RS256", "ES256"]
+        payload = jwt.decode(
+            token,
+            signing_key,
+            algorithms=algorithms,
+            audience="authenticated"
+        )
+        _token_cache[key] = payload
+
+    return payload
+
 async def verify_supabase_token(authorization: Optional[str] = Header(None)) -> Dict[str, Any]:
     """
     Verify Supabase JWT token and return user information.
@@ -15,7 +139,7 @@ async def verify_supabase_token(authorization: Optional[str] = Header(None)) ->
         authorization: Bearer token from Authorization header
 
     Returns:
-        Dict containing user information
+        Dict containing user information; google_id is always present
 
     Raises:
         HTTPException: If token is invalid or missing
@@ -29,11 +153,12 @@ async def verify_supabase_token(authorization: Optional[str] = Header(None)) ->
     token = authorization.replace("Bearer ", "")
 
     try:
-        # Decode JWT to get user info - strict verification for production
-        payload = jwt.decode(token, options={"verify_signature": False})
+        # Verify JWT signature, expiry and audience before trusting its claims
+        payload = await _decode_token(token)
         user_id = payload.get("sub")
         email = payload.get("email")
 
+        # Endpoints rely on google_id (the sub claim) being set, so reject tokens without it here
         if not user_id or not email:
             raise HTTPException(status_code=401, detail="Invalid JWT token: missing user_id or email")
 
@@ -44,6 +169,8 @@ async def verify_supabase_token(authorization: Optional[str] = Header(None)) ->
             "google_id": user_id
         }
 
+    except HTTPException:
+        raise
     except jwt.ExpiredSignatureError:
         raise HTTPException(status_code=401, detail="Token has expired")
     except jwt.InvalidTokenError as e:
@@ -72,9 +199,6 @@ async def sync_user_with_database(user: Dict[str, Any] = Depends(verify_supabase
         google_id = user["google_id"]
         email = user["email"]
 
-        if not google_id:
-            raise HTTPException(status_code=400, detail="Google ID not found in user metadata")
-
         # Check if user exists in our database
         existing_user = get_user_by_google_id(google_id)
 
@@ -103,34 +227,18 @@ async def get_google_auth_url(user: Dict[str, Any] = Depends(verify_supabase_tok
     This bypasses Supabase for Google OAuth to get proper tokens.
     """
     try:
-        import secrets
-        from urllib.parse import urlencode
-
         # Generate state parameter for security
-        state = secrets.token_urlsafe(32)
+        state = secrets.token_urlsafe(_OAUTH_STATE_NBYTES)
 
         # Store state temporarily (in production, use Redis or database)
-        from app.tools.email_tools import _oauth_states
-        import datetime
         _oauth_states[state] = {
             "google_id": user["google_id"],
             "email": user["email"],
-            "created_at": datetime.datetime.utcnow().isoformat()
+            "created_at": datetime.datetime.now(datetime.timezone.utc).isoformat()
         }
 
-        # Build Google OAuth URL
-        frontend_url = os.getenv('FRONTEND_URL', 'http://localhost:3000')
-        params = {
-            "client_id": os.getenv("GOOGLE_CLIENT_ID"),
-            "redirect_uri": f"{frontend_url}/auth/google/callback",
-            "scope": "https://www.googleapis.com/auth/gmail.readonly https://www.googleapis.com/auth/gmail.compose https://www.googleapis.com/auth/spreadsheets",
-            "response_type": "code",
-            "access_type": "offline",
-            "prompt": "consent",
-            "state": state
-        }
-
-        auth_url = f"https://accounts.google.com/o/oauth2/v2/auth?{urlencode(params)}"
+        # Build Google OAuth URL; token_urlsafe output needs no escaping
+        auth_url = f"{_GOOGLE_AUTH_URL_PREFIX}&state={state}"
 
         return {
             "auth_url": auth_url,
@@ -147,50 +255,31 @@ async def google_oauth_callback(code: str, state: str, user: Dict[str, Any] = De
     Called by the frontend after receiving the authorization code.
     """
     try:
-        # Verify state parameter with better error handling
-        from app.tools.email_tools import _oauth_states
-        
-        # Check if state exists and is valid
-        if state not in _oauth_states:
-            print(f"State {state} not found in available states: {list(_oauth_states.keys())}")
+        # Check if state exists and is valid (expired states are evicted by the cache)
+        user_data = _oauth_states.get(state)
+        if user_data is None:
+            print(f"State {state} not found or expired ({len(_oauth_states)} pending states)")
             raise HTTPException(status_code=400, detail="Invalid or expired state parameter")
 
         # Verify that the user matches the state
-        user_data = _oauth_states[state]
         if user_data["google_id"] != user["google_id"]:
             print(f"State user mismatch: state has {user_data['google_id']}, current user has {user['google_id']}")
             raise HTTPException(status_code=400, detail="State parameter does not match current user")
 
-        # Check if state has expired (older than 10 minutes)
-        import datetime
-        from datetime import datetime as dt
-        state_created = dt.fromisoformat(user_data.get("created_at", "2024-01-01T00:00:00Z"))
-        if (dt.utcnow() - state_created).total_seconds() > 600:  # 10 minutes
-            del _oauth_states[state]
-            raise HTTPException(status_code=400, detail="State parameter has expired")
-
-        # Exchange authorization code for tokens
-        import requests
-
-        token_url = "https://oauth2.googleapis.com/token"
-        frontend_url = os.getenv('FRONTEND_URL', 'http://localhost:3000')
-        
-        # Validate required environment variables
-        client_id = os.getenv("GOOGLE_CLIENT_ID")
-        client_secret = os.getenv("GOOGLE_CLIENT_SECRET")
-        
-        if not client_id or not client_secret:
+        # Validate required configuration
+        if not _GOOGLE_CLIENT_ID or not _GOOGLE_CLIENT_SECRET:
             raise HTTPException(status_code=500, detail="Google OAuth credentials not configured")
 
+        # Exchange authorization code for tokens
         data = {
-            "client_id": client_id,
-            "client_secret": client_secret,
+            "client_id": _GOOGLE_CLIENT_ID,
+            "client_secret": _GOOGLE_CLIENT_SECRET,
             "code": code,
             "grant_type": "authorization_code",
-            "redirect_uri": f"{frontend_url}/auth/google/callback"
+            "redirect_uri": _REDIRECT_URI
         }
 
-        response = requests.post(token_url, data=data)
+        response = await _http_client.post(_GOOGLE_TOKEN_URL, data=data)
         
         if response.status_code != 200:
             print(f"Google token exchange failed with status {response.status_code}: {response.text}")
@@ -207,7 +296,7 @@ async def google_oauth_callback(code: str, state: str, user: Dict[str, Any] = De
             raise HTTPException(status_code=400, detail=f"Token exchange failed: {tokens['error']}")
 
         # Clean up state after successful token exchange
-        del _oauth_states[state]
+        _oauth_states.pop(state, None)
 
         # Return tokens to frontend
         return {
@@ -255,24 +344,23 @@ async def store_google_tokens(
         
         if not token_data.get("refresh_token"):
             raise HTTPException(status_code=400, detail="Refresh token is required")
-        from app.tools.email_tools import token_store
-        from app.core.supabase_client import supabase
-        import datetime
 
         google_id = user["google_id"]
-        if not google_id:
-            raise HTTPException(status_code=400, detail="Google ID not found")
+
+        # One timestamp for both the in-memory and persisted copies
+        now = datetime.datetime.now(datetime.timezone.utc)
+        expires_in = token_data.get("expires_in", 3600)
 
         # Store tokens in memory for immediate use
         token_store[google_id] = {
             "access_token": token_data.get("access_token"),
             "refresh_token": token_data.get("refresh_token"),
-            "expires_in": token_data.get("expires_in", 3600),
-            "created_at": datetime.datetime.utcnow().isoformat()
+            "expires_in": expires_in,
+            "created_at": now.isoformat()
         }
 
         # Also store tokens in Supabase for persistence
-        expires_at = datetime.datetime.utcnow() + datetime.timedelta(seconds=token_data.get("expires_in", 3600))
+        expires_at = now + datetime.timedelta(seconds=expires_in)
 
         connection_data = {
             "user_id": user["user_id"],  # Use Supabase user ID, not Google ID
@@ -282,119 +370,18 @@ async def store_google_tokens(
             "expires_at": expires_at.isoformat()
         }
 
-        # Use upsert to handle both insert and update in one operation
+        # Use upsert to handle both insert and update in one operation;
+        # conflicts resolve on the unique (user_id, app_name) constraint
         try:
-            # First check if a connection already exists
-            existing_response = supabase.table('user_connections').select('*').eq('user_id', user["user_id"]).eq('app_name', 'gmail').execute()
-            
-            # Handle different response formats - some return dict, others return objects
-            if isinstance(existing_response, dict):
-                # Response is a dictionary
-                existing_data = existing_response.get('data', [])
-            elif hasattr(existing_response, 'data'):
-                # Response is an object with .data attribute
-                existing_data = existing_response.data
-            else:
-                # Fallback - assume response is the data directly
-                existing_data = existing_response or []
-            
-            # Check if we got data and it's not empty
-            if existing_data:
-                # Update existing connection
-                update_response = supabase.table('user_connections').update({
-                    "refresh_token": connection_data["refresh_token"],
-                    "access_token": connection_data["access_token"],
-                    "expires_at": connection_data["expires_at"],
-                    "updated_at": datetime.datetime.utcnow().isoformat()
-                }).eq('user_id', user["user_id"]).eq('app_name', 'gmail').execute()
-                
-                # Check if update had errors by checking response format
-                if isinstance(update_response, dict):
-                    update_success = 'data' in update_response and update_response.get('data') is not None
-                elif hasattr(update_response, 'data'):
-                    update_success = update_response.data is not None
-                else:
-                    update_success = update_response is not None
-                
-                if update_success:
-                    print(f"Update successful: {update_response}")
-                else:
-                    print(f"Update failed - no data returned")
-                    # Try insert instead
-                    insert_response = supabase.table('user_connections').insert(connection_data).execute()
-                    
-                    # Check if insert had errors
-                    if isinstance(insert_response, dict):
-                        insert_success = 'data' in insert_response and insert_response.get('data') is not None
-                    elif hasattr(insert_response, 'data'):
-                        insert_success = insert_response.data is not None
-                    else:
-                        insert_success = insert_response is not None
-                    
-                    if insert_success:
-                        print(f"Insert successful after update failed: {insert_response}")
-                    else:
-                        raise HTTPException(status_code=500, detail=f"Both update and insert failed")
-            else:
-                # Insert new connection
-                insert_response = supabase.table('user_connections').insert(connection_data).execute()
-                
-                # Check if insert had errors
-                if isinstance(insert_response, dict):
-                    insert_success = 'data' in insert_response and insert_response.get('data') is not None
-                elif hasattr(insert_response, 'data'):
-                    insert_success = insert_response.data is not None
-                else:
-                    insert_success = insert_response is not None
-                
-                if insert_success:
-                    print(f"Insert successful: {insert_response}")
-                else:
-                    print(f"Insert failed - trying update instead")
-                    # Try update instead
-                    update_response = supabase.table('user_connections').update({
-                        "refresh_token": connection_data["refresh_token"],
-                        "access_token": connection_data["access_token"],
-                        "expires_at": connection_data["expires_at"],
-                        "updated_at": datetime.datetime.utcnow().isoformat()
-                    }).eq('user_id', user["user_id"]).eq('app_name', 'gmail').execute()
-                    
-                    # Check if update had errors
-                    if isinstance(update_response, dict):
-                        update_success = 'data' in update_response and update_response.get('data') is not None
-                    elif hasattr(update_response, 'data'):
-                        update_success = update_response.data is not None
-                    else:
-                        update_success = update_response is not None
-                    
-                    if update_success:
-                        print(f"Update successful after insert failed: {update_response}")
-                    else:
-                        raise HTTPException(status_code=500, detail=f"Both insert and update failed")
-                
+            upsert_response = await supabase.table('user_connections').upsert(connection_data, onConflict='user_id,app_name').execute()
+
+            if upsert_response['data'] is None:
+                raise HTTPException(status_code=500, detail="Upsert failed: no data returned")
+        except HTTPException:
+            raise
         except Exception as db_error:
-            error_str = str(db_error)
-            print(f"Database operation failed: {error_str}")
-            
-            # If we still have issues, try upsert as final fallback
-            try:
-                upsert_response = supabase.table('user_connections').upsert(connection_data, onConflict='user_id,app_name').execute()
-                
-                # Check if upsert had errors
-                if isinstance(upsert_response, dict):
-                    upsert_success = 'data' in upsert_response and upsert_response.get('data') is not None
-                elif hasattr(upsert_response, 'data'):
-                    upsert_success = upsert_response.data is not None
-                else:
-                    upsert_success = upsert_response is not None
-                
-                if upsert_success:
-                    print(f"Upsert fallback successful: {upsert_response}")
-                else:
-                    raise HTTPException(status_code=500, detail=f"Upsert failed: no data returned")
-            except Exception as upsert_error:
-                print(f"Upsert fallback failed: {str(upsert_error)}")
-                raise HTTPException(status_code=500, detail=f"Failed to store connection: {error_str}")
+            print(f"Database operation failed: {str(db_error)}")
+            raise HTTPException(status_code=500, detail=f"Failed to store connection: {str(db_error)}")
 
         return {"message": "Tokens stored successfully"}
 
@@ -408,19 +395,9 @@ async def get_google_tokens(user: Dict[str, Any] = Depends(verify_supabase_token
     """
     try:
         # Check if user has Gmail connection using Supabase user ID
-        from app.core.supabase_client import supabase
-        response = supabase.table('user_connections').select('*').eq('user_id', user["user_id"]).eq('app_name', 'gmail').execute()
-
-        # Handle different response formats - some return dict, others return objects
-        if isinstance(response, dict):
-            # Response is a dictionary
-            response_data = response.get('data', [])
-        elif hasattr(response, 'data'):
-            # Response is an object with .data attribute
-            response_data = response.data
-        else:
-            # Fallback - assume response is the data directly
-            response_data = response or []
+        response = await supabase.table('user_connections').select('*').eq('user_id', user["user_id"]).eq('app_name', 'gmail').execute()
+
+        response_data = response['data']
 
         # Check if we got data and it's not empty
         if not response_data:
@@ -430,15 +407,14 @@ async def get_google_tokens(user: Dict[str, Any] = Depends(verify_supabase_token
                 "message": "Gmail not connected"
             }
 
-        # Handle both single record and array responses
-        connection_data = response_data[0] if isinstance(response_data, list) and response_data else response_data
+        connection_data = response_data[0]
 
         # Return success (don't expose actual tokens)
         return {
             "connected": True,
             "app_name": "gmail",
-            "connected_at": connection_data.get("created_at") if isinstance(connection_data, dict) else None,
-            "updated_at": connection_data.get("updated_at") if isinstance(connection_data, dict) else None
+            "connected_at": connection_data.get("created_at"),
+            "updated_at": connection_data.get("updated_at")
         }
 
     except Exception as e:
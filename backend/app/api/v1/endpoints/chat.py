@@ -1,10 +1,24 @@
+import orjson
+from typing import AsyncIterator
 from fastapi import APIRouter
-from app.models.schemas import ChatRequest, ChatResponse
-from app.core.enhanced_llm_wrapper import get_llm_response_with_all_tools
+from fastapi.responses import StreamingResponse
+from app.models.schemas import ChatRequest
+from app.core.enhanced_llm_wrapper import stream_llm_response_with_all_tools
 
 router = APIRouter()
 
-@router.post("/chat", response_model=ChatResponse)
+async def _sse_events(parts: AsyncIterator[str]) -> AsyncIterator[bytes]:
+    # JSON-encode each chunk so newlines in the reply don't break SSE framing
+    async for part in parts:
+        yield b"data: " + orjson.dumps(part) + b"\n\n"
+    yield b"event: done\ndata: {}\n\n"
+
+@router.post("/chat")
 async def chat_endpoint(request: ChatRequest):
-    reply = await get_llm_response_with_all_tools(request.message)
-    return ChatResponse(reply=reply)
\ No newline at end of file
+    # Stream the reply so clients get the first tokens without waiting for the full generation
+    return StreamingResponse(
+        _sse_events(stream_llm_response_with_all_tools(request.message)),
+        media_type="text/event-stream",
+        # Keep proxies such as nginx from buffering the stream
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
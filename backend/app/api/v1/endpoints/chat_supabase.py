@@ -3,15 +3,43 @@ Enhanced chat endpoint with database integration
 Uses Supabase JWT authentication for secure, personalized conversations
 """
 
-from fastapi import APIRouter, HTTPException, Depends, Header
-from typing import List, Dict, Any
+import asyncio
+import orjson
+from datetime import datetime
+from fastapi import APIRouter, HTTPException, Depends, Header, Query
+from fastapi.responses import StreamingResponse
+from typing import List, Dict, Any, Optional
 from app.models.schemas import ChatRequest, ChatResponse
-from app.core.enhanced_llm_wrapper_supabase import get_llm_response_with_supabase
-from app.core.db_client import get_messages, add_message, add_message_to_conversation
+from app.core.enhanced_llm_wrapper_supabase import get_llm_response_with_supabase, stream_llm_response_with_supabase
+from app.core.db_client import get_messages, add_messages_bulk, add_messages_to_conversation
 from app.api.v1.endpoints.auth.google import verify_supabase_token
+from app.core.cache import conversation_list_cache, invalidate
+from app.core.users import get_user_id
+from app.core.chat_memory import invalidate_user_history
 
 router = APIRouter()
 
+async def _store_turn(request: ChatRequest, google_id: str, user_id: int, reply: str):
+    """Add the user message and AI reply to history together"""
+    if request.conversation_id:
+        # New conversation-based system - store the turn in one INSERT
+        await asyncio.to_thread(
+            add_messages_to_conversation,
+            request.conversation_id,
+            [('user', request.message), ('ai', reply)]
+        )
+        # Message counts in the conversation list changed
+        invalidate(conversation_list_cache, google_id)
+    else:
+        # Legacy system for backwards compatibility
+        # Always use integer user_id for message storage
+        await asyncio.to_thread(
+            add_messages_bulk,
+            [(int(user_id), 'user', request.message), (int(user_id), 'ai', reply)]
+        )
+    # Written around ChatMemory, so its cached history for the user is stale
+    invalidate_user_history(int(user_id))
+
 @router.post("/chat", response_model=ChatResponse)
 async def chat_endpoint(
     request: ChatRequest,
@@ -32,53 +60,9 @@ async def chat_endpoint(
         supabase_user_id = user["user_id"]
         google_id = user["google_id"]
 
-        if not google_id:
-            raise HTTPException(
-                status_code=400,
-                detail="Google ID not found. Please ensure you logged in with Google."
-            )
-
-        # Get user ID (user should already exist)
-        from app.api.v1.endpoints.documents import get_user_id
-        user_id = get_user_id(google_id)
-
         # Google tokens are now retrieved from the secure database storage
 
-        # Add user message to history (new conversation-based system)
-        if request.conversation_id:
-            # New conversation-based system - only store messages with conversation_id
-            add_message_to_conversation(request.conversation_id, 'user', request.message)
-        else:
-            # Legacy message system for backward compatibility
-            # Try to use in-memory conversation store
-            try:
-                from app.api.v1.endpoints.conversations import _conversations_store
-
-                # Find or create conversation for this user
-                user_conversations = [
-                    conv_id for conv_id, conv_data in _conversations_store.items()
-                    if conv_data['user_google_id'] == user["google_id"]
-                ]
-
-                if user_conversations:
-                    # Use most recent conversation
-                    conversation_id = user_conversations[0]
-                    add_message_to_conversation(conversation_id, 'user', request.message)
-                else:
-                    # Create new conversation and add message
-                    import uuid
-                    conversation_id = str(uuid.uuid4())
-                    _conversations_store[conversation_id] = {
-                        'user_google_id': user["google_id"],
-                        'title': 'Chat',
-                        'message_count': 0,
-                        'created_at': 'now()'
-                    }
-                    add_message_to_conversation(conversation_id, 'user', request.message)
-            except Exception as e:
-                # Fallback to old system if conversation system fails
-                # Use the integer user_id for message storage
-                add_message(int(user_id), 'user', request.message)
+        user_id = await get_user_id(google_id)
 
         # Get AI response with user context
         reply = await get_llm_response_with_supabase(
@@ -89,14 +73,9 @@ async def chat_endpoint(
             conversation_id=request.conversation_id
         )
 
-        # Add AI message to history
-        if request.conversation_id:
-            # New conversation-based system
-            add_message_to_conversation(request.conversation_id, 'ai', reply)
-        else:
-            # Legacy system for backwards compatibility
-            # Always use integer user_id for message storage
-            add_message(int(user_id), 'ai', reply)
+        # Add the user message and AI reply to history together, keeping the
+        # insert off the critical path before the LLM call
+        await _store_turn(request, google_id, user_id, reply)
 
         return ChatResponse(reply=reply)
 
@@ -108,26 +87,58 @@ async def chat_endpoint(
             detail=f"An error occurred while processing your request: {str(e)}"
         )
 
+@router.post("/chat/stream")
+async def chat_stream_endpoint(
+    request: ChatRequest,
+    user: Dict[str, Any] = Depends(verify_supabase_token)
+):
+    """
+    Streaming variant of /chat, sent as server-sent events.
+
+    Each chunk of the reply is a JSON-encoded string in a `data:` event, so the
+    first tokens of study answers arrive while the rest is still being generated.
+    A final `done` event follows once the turn has been stored.
+    """
+    google_id = user["google_id"]
+
+    user_id = await get_user_id(google_id)
+
+    async def events():
+        reply_parts = []
+        async for part in stream_llm_response_with_supabase(
+            message=request.message,
+            user_id=user_id,
+            google_id=google_id,
+            conversation_id=request.conversation_id
+        ):
+            reply_parts.append(part)
+            yield b"data: " + orjson.dumps(part) + b"\n\n"
+        await _store_turn(request, google_id, user_id, "".join(reply_parts))
+        yield b"event: done\ndata: {}\n\n"
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        # Keep proxies such as nginx from buffering the stream
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @router.get("/chat/messages")
 async def get_chat_messages(
+    limit: int = Query(50, ge=1, le=500),
+    before: Optional[datetime] = Query(None, description="Only return messages created before this time"),
     user: Dict[str, Any] = Depends(verify_supabase_token)
 ) -> List[Dict[str, Any]]:
     """
-    Get chat messages for the authenticated user.
+    Get the most recent chat messages for the authenticated user, oldest first.
+    Pass the created_at of the oldest message received as `before` to page back.
     """
     try:
         google_id = user["google_id"]
 
-        if not google_id:
-            raise HTTPException(
-                status_code=400,
-                detail="Google ID not found. Please ensure you logged in with Google."
-            )
-
         # Get user ID (user should already exist)
-        from app.api.v1.endpoints.documents import get_user_id
-        user_id = get_user_id(google_id)
-        messages = get_messages(user_id)
+        user_id = await get_user_id(google_id)
+        messages = await asyncio.to_thread(get_messages, user_id, limit, before)
         return messages
 
     except HTTPException:
@@ -14,9 +14,11 @@ from app.core.db_client import (
     get_user_conversations,
     delete_conversation as db_delete_conversation,
     update_conversation_title,
-    get_messages_by_conversation,
+    get_owned_conversation_messages,
     add_message_to_conversation
 )
+from app.core.cache import conversation_list_cache, invalidate
+from app.core.chat_memory import invalidate_user_history, invalidate_conversation_history
 
 router = APIRouter()
 
@@ -42,11 +44,10 @@ async def create_new_conversation(
     """
     try:
         google_id = user["google_id"]
-        if not google_id:
-            raise HTTPException(status_code=400, detail="Google ID not found")
 
         # Create conversation in database
         conversation_id = create_conversation(google_id, conversation.title)
+        invalidate(conversation_list_cache, google_id)
 
         return {"conversation_id": conversation_id}
     except Exception as e:
@@ -64,11 +65,13 @@ async def list_conversations(
     """
     try:
         google_id = user["google_id"]
-        if not google_id:
-            raise HTTPException(status_code=400, detail="Google ID not found")
 
-        # Get conversations from database
-        conversations = get_user_conversations(google_id)
+        # Serve from cache; writes below drop the entry
+        conversations = conversation_list_cache.get(google_id)
+        if conversations is None:
+            # Get conversations from database
+            conversations = get_user_conversations(google_id)
+            conversation_list_cache[google_id] = conversations
 
         return conversations
     except Exception as e:
@@ -87,11 +90,12 @@ async def delete_conversation_endpoint(
     """
     try:
         google_id = user["google_id"]
-        if not google_id:
-            raise HTTPException(status_code=400, detail="Google ID not found")
 
         # Delete conversation from database (includes ownership check)
-        db_delete_conversation(conversation_id, google_id)
+        user_id = db_delete_conversation(conversation_id, google_id)
+        invalidate(conversation_list_cache, google_id)
+        invalidate_user_history(user_id)
+        invalidate_conversation_history(conversation_id)
 
         return {"message": "Conversation deleted successfully"}
     except ValueError as e:
@@ -117,11 +121,10 @@ async def update_conversation(
     """
     try:
         google_id = user["google_id"]
-        if not google_id:
-            raise HTTPException(status_code=400, detail="Google ID not found")
 
         # Update conversation title in database (includes ownership check)
         update_conversation_title(conversation_id, google_id, conversation.title)
+        invalidate(conversation_list_cache, google_id)
 
         return {"message": "Conversation updated successfully"}
     except ValueError as e:
@@ -148,26 +151,19 @@ async def get_conversation_messages(
     """
     try:
         google_id = user["google_id"]
-        if not google_id:
-            raise HTTPException(status_code=400, detail="Google ID not found")
 
         # Get messages with ownership check
-        messages = get_messages_by_conversation(conversation_id, google_id)
-
-        # If no messages returned, check if conversation exists
-        if not messages:
-            # Check if conversation exists at all
-            from app.core.db_client import execute_query
-            conv_check = execute_query("SELECT id FROM conversations WHERE id = %s", (conversation_id,))
-            if not conv_check:
-                raise HTTPException(status_code=404, detail="Conversation not found")
-            # If conversation exists but no messages returned, user doesn't own it
-            # (empty conversation is still valid - return empty list)
-            return []
+        messages = get_owned_conversation_messages(conversation_id, google_id)
 
         return messages
     except HTTPException:
         raise
+    except ValueError as e:
+        if "not found" in str(e).lower():
+            raise HTTPException(status_code=404, detail="Conversation not found")
+        elif "access denied" in str(e).lower():
+            raise HTTPException(status_code=403, detail="Access denied")
+        raise HTTPException(status_code=500, detail=str(e))
     except Exception as e:
         raise HTTPException(
             status_code=500,
@@ -185,11 +181,11 @@ async def add_message_endpoint(
     """
     try:
         google_id = user["google_id"]
-        if not google_id:
-            raise HTTPException(status_code=400, detail="Google ID not found")
 
         # Add message to conversation (includes ownership check)
-        add_message_to_conversation(conversation_id, "user", message.content)
+        user_id = add_message_to_conversation(conversation_id, "user", message.content)
+        invalidate(conversation_list_cache, google_id)
+        invalidate_user_history(user_id)
 
         return {"message": "Message added successfully"}
     except ValueError as e:
@@ -1,23 +1,54 @@
 from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Header, Form
-from fastapi.responses import JSONResponse
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Set
 import os
+import asyncio
 import tempfile
 import uuid
 from app.core.config import settings
-from app.core.supabase_client import get_supabase_client, supabase
-from supabase import create_client, Client
+from app.core.supabase_client import get_supabase_client, get_supabase_service_client
+from supabase import Client
+from postgrest.types import ReturnMethod
 from app.api.v1.endpoints.auth.google import verify_supabase_token
+from app.core.cache import document_list_cache, invalidate
+from app.core import semantic_cache
+from app.core.users import get_user_id
+from app.models.schemas import SignedUploadRequest, ProcessDocumentRequest
 import httpx
 import io
 from pypdf import PdfReader
 from docx import Document
 import openai
 import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 
 router = APIRouter()
 
+# PDF/DOCX parsing is CPU-bound pure Python that holds the GIL; run it in worker
+# processes so large uploads don't stall the event loop or each other
+EXTRACTION_WORKERS = 2
+_extraction_pool: Optional[ProcessPoolExecutor] = None
+
+@router.on_event("startup")
+def _start_extraction_pool():
+    global _extraction_pool
+    # Spawned workers don't inherit the server's threads, sockets or DB pool,
+    # which forking a running event loop process would copy into every child
+    _extraction_pool = ProcessPoolExecutor(max_workers=EXTRACTION_WORKERS, mp_context=get_context("spawn"))
+
+@router.on_event("shutdown")
+def _shutdown_extraction_pool():
+    if _extraction_pool is not None:
+        _extraction_pool.shutdown(wait=False, cancel_futures=True)
+
+# Chunks per embeddings request; keeps each call well under OpenAI's input limits
+EMBEDDING_BATCH_SIZE = 96
+
+# Created once so every upload reuses the client's HTTPS connection pool; the sync
+# client is thread-safe and embed_chunks runs in worker threads
+_embedding_client = openai.OpenAI(api_key=settings.OPENAI_API_KEY) if settings.OPENAI_API_KEY else None
+
 # Simple text splitter implementation
 class SimpleTextSplitter:
     def __init__(self, chunk_size: int, chunk_overlap: int):
@@ -25,31 +56,21 @@ class SimpleTextSplitter:
         self.chunk_overlap = chunk_overlap
 
     def split_text(self, text: str) -> list[str]:
-        chunks = []
-        start = 0
-
-        while start < len(text):
-            end = start + self.chunk_size
-            if end > len(text):
-                end = len(text)
-
-            chunks.append(text[start:end])
-            start = end - self.chunk_overlap
-
-            if start >= len(text):
-                break
+        if not text:
+            return []
 
-        return chunks
+        # Chunk starts are a fixed stride apart; stop once a chunk has reached the end
+        # of the text so no trailing chunk is just a copy of the previous overlap
+        step = self.chunk_size - self.chunk_overlap
+        last_start = max(len(text) - self.chunk_overlap, 1)
+        return [text[start:start + self.chunk_size] for start in range(0, last_start, step)]
 
 def extract_text_from_pdf(file_content: bytes) -> str:
     """Extract text from PDF file"""
     try:
         pdf_file = io.BytesIO(file_content)
         pdf_reader = PdfReader(pdf_file)
-        text = ""
-        for page in pdf_reader.pages:
-            text += page.extract_text() + "\n"
-        return text.strip()
+        return "\n".join(page.extract_text() or "" for page in pdf_reader.pages).strip()
     except Exception as e:
         print(f"Error extracting text from PDF: {e}")
         return f"[PDF Document] - Error extracting text: {str(e)}"
@@ -59,10 +80,7 @@ def extract_text_from_docx(file_content: bytes) -> str:
     try:
         docx_file = io.BytesIO(file_content)
         doc = Document(docx_file)
-        text = ""
-        for paragraph in doc.paragraphs:
-            text += paragraph.text + "\n"
-        return text.strip()
+        return "\n".join(paragraph.text for paragraph in doc.paragraphs).strip()
     except Exception as e:
         print(f"Error extracting text from DOCX: {e}")
         return f"[DOCX Document] - Error extracting text: {str(e)}"
@@ -82,28 +100,20 @@ def generate_embeddings(text: str, openai_api_key: str) -> list[float]:
         # Limit to first 5 chunks to avoid rate limits and long processing
         chunks = chunks[:5] if len(chunks) > 5 else chunks
 
-        # Generate embeddings for chunks
-        chunk_embeddings = []
+        # Generate embeddings for all chunks in one request
         client = openai.OpenAI(api_key=openai_api_key)
 
-        for i, chunk in enumerate(chunks):
-            print(f"Generating embedding for chunk {i+1}/{len(chunks)}")
-            response = client.embeddings.create(
-                input=chunk,
-                model='text-embedding-3-small'
-            )
-            chunk_embeddings.append(response.data[0].embedding)
+        print(f"Generating embeddings for {len(chunks)} chunks")
+        response = client.embeddings.create(
+            input=chunks,
+            model='text-embedding-3-small'
+        )
+        chunk_embeddings = [item.embedding for item in response.data]
 
         # Average the embeddings
         if chunk_embeddings:
-            embedding_dim = len(chunk_embeddings[0])
-            embedding = [0.0] * embedding_dim
-            for chunk_embedding in chunk_embeddings:
-                for i in range(embedding_dim):
-                    embedding[i] += chunk_embedding[i]
-            for i in range(embedding_dim):
-                embedding[i] /= len(chunk_embeddings)
-            print(f"Successfully generated embedding with {embedding_dim} dimensions")
+            embedding = np.asarray(chunk_embeddings, dtype=np.float32).mean(axis=0).tolist()
+            print(f"Successfully generated embedding with {len(embedding)} dimensions")
             return embedding
 
         return []
@@ -111,19 +121,84 @@ def generate_embeddings(text: str, openai_api_key: str) -> list[float]:
         print(f"Error generating embeddings: {e}")
         return []
 
-def get_user_id(google_id: str) -> int:
-    """Get user ID from Google ID - assumes user already exists"""
-    try:
-        # Get existing user
-        result = supabase.table('users').select('id').eq('google_id', google_id).execute()
-
-        if result['data'] and len(result['data']) > 0:
-            return result['data'][0]['id']
-        else:
-            raise Exception(f"User with google_id {google_id} not found in database")
-
-    except Exception as e:
-        raise Exception(f"Failed to get user: {str(e)}")
+def embed_chunks(chunks: list[str]) -> list[list[float]]:
+    """Generate one embedding per chunk, batching chunks into as few requests as possible"""
+    embeddings = []
+
+    # The embeddings endpoint takes a list of inputs; send chunks in batches
+    for start in range(0, len(chunks), EMBEDDING_BATCH_SIZE):
+        batch = chunks[start:start + EMBEDDING_BATCH_SIZE]
+        print(f"Generating embeddings for chunks {start+1}-{start+len(batch)}/{len(chunks)}")
+        response = _embedding_client.embeddings.create(
+            input=batch,
+            model="text-embedding-3-small"
+        )
+        embeddings.extend(item.embedding for item in response.data)
+
+    return embeddings
+
+# Supported upload formats: content type -> extension -> text extractor
+_CONTENT_TYPE_EXTENSIONS = {
+    'application/pdf': 'pdf',
+    'application/vnd.openxmlformats-officedocument.wordprocessingml.document': 'docx'
+}
+_TEXT_EXTRACTORS = {
+    'pdf': extract_text_from_pdf,
+    'docx': extract_text_from_docx
+}
+
+def get_text_extractor(file_extension: str):
+    """Return the text extraction function for a file extension"""
+    extractor = _TEXT_EXTRACTORS.get(file_extension)
+    if extractor is None:
+        raise HTTPException(status_code=400, detail="Unsupported file type")
+    return extractor
+
+async def index_document_text(full_text: str, user_id: int, google_id: str, course_name: str, original_file_name: str, file_path: str) -> int:
+    """Chunk extracted text, embed the chunks and save them to the documents table; returns the chunk count"""
+    if not full_text.strip():
+        raise HTTPException(status_code=400, detail="No text content could be extracted from the file")
+
+    # Split text into chunks using LangChain
+    text_splitter = RecursiveCharacterTextSplitter(
+        chunk_size=1000,
+        chunk_overlap=150,
+        length_function=len
+    )
+    chunks = text_splitter.split_text(full_text)
+    print(f"Split text into {len(chunks)} chunks")
+
+    # Generate embeddings for each chunk
+    if not hasattr(settings, 'OPENAI_API_KEY') or not settings.OPENAI_API_KEY:
+        raise HTTPException(status_code=500, detail="OpenAI API key not configured")
+
+    embeddings = await asyncio.to_thread(embed_chunks, chunks)
+
+    # Prepare data for insertion
+    data_to_insert = []
+    for i, (chunk, embedding) in enumerate(zip(chunks, embeddings)):
+        data_to_insert.append({
+            "user_id": user_id,
+            "content": chunk,
+            "embedding": embedding,
+            "course_name": course_name,
+            "original_file_name": original_file_name,
+            "file_path": file_path,
+            "chunk_index": i,
+            "total_chunks": len(chunks)
+        })
+
+    # Insert all chunks into documents table; the inserted rows (embeddings included)
+    # aren't needed back, so ask PostgREST not to echo them
+    service_supabase = get_supabase_service_client()
+    await asyncio.to_thread(
+        service_supabase.table("documents").insert(data_to_insert, returning=ReturnMethod.minimal).execute
+    )
+    invalidate(document_list_cache, user_id)
+    # Cached study answers may now be missing what this document says
+    semantic_cache.invalidate(google_id)
+
+    return len(chunks)
 
 @router.get("/user")
 async def get_user_documents(
@@ -137,27 +212,29 @@ async def get_user_documents(
         email = user.get("email", "")
 
         # Get user
-        user_id = get_user_id(google_id)
+        user_id = await get_user_id(google_id)
         print(f"DEBUG: Authenticated user - google_id: {google_id}, email: {email}")
         print(f"DEBUG: Mapped to internal user_id: {user_id}")
 
+        # Serve from cache; upload and delete drop the entry
+        cached_docs = document_list_cache.get(user_id)
+        if cached_docs is not None:
+            return cached_docs
+
         # Use service role client directly with proper user filtering for reliable access
         # This bypasses RLS issues while still maintaining security by filtering by user_id
         print(f"DEBUG: Using service role client with user_id filtering")
-        from app.core.supabase_client import get_supabase_service_client
         service_supabase = get_supabase_service_client()
 
-        documents = service_supabase.table('documents').select('*').eq('user_id', user_id).execute()
-        print(f"DEBUG: Service role found {len(documents.data) if hasattr(documents, 'data') and documents.data else 0} documents")
+        documents = await asyncio.to_thread(
+            service_supabase.table('documents').select('*').eq('user_id', user_id).execute
+        )
+        # The query is already filtered by user_id, so its rows are returned as-is
+        docs = documents.data or []
+        print(f"DEBUG: Service role found {len(docs)} documents")
 
-        # Verify the documents belong to the authenticated user (double security check)
-        if hasattr(documents, 'data') and documents.data:
-            filtered_docs = [doc for doc in documents.data if doc['user_id'] == user_id]
-            print(f"DEBUG: After security verification, returning {len(filtered_docs)} documents")
-            return filtered_docs
-        else:
-            print("DEBUG: No documents found in service role query")
-            return []
+        document_list_cache[user_id] = docs
+        return docs
 
     except Exception as e:
         print(f"DEBUG: Error getting documents: {str(e)}")
@@ -172,97 +249,56 @@ async def upload_document(
 ):
     """Upload a document, extract text, chunk it, generate embeddings, and save to database"""
     try:
-        # Validate file type
-        allowed_types = ['application/pdf', 'application/vnd.openxmlformats-officedocument.wordprocessingml.document']
-        if file.content_type not in allowed_types:
+        # Validate file type; the content type also decides the extension and extractor
+        file_extension = _CONTENT_TYPE_EXTENSIONS.get(file.content_type)
+        if file_extension is None:
             raise HTTPException(
                 status_code=400,
                 detail=f"File type {file.content_type} not allowed. Only PDF and DOCX files are supported."
             )
+        extract_text = _TEXT_EXTRACTORS[file_extension]
 
         # Get user info
         google_id = user["google_id"]
-        user_id = get_user_id(google_id)
+        user_id = await get_user_id(google_id)
 
         # Read file content
         file_content = await file.read()
 
         # Create unique file path for storage
-        file_extension = file.filename.split('.')[-1].lower()
         unique_filename = f"{uuid.uuid4()}.{file_extension}"
         file_path = f"{google_id}/{unique_filename}"
 
+        service_supabase = get_supabase_service_client()
+
         # Upload file to Supabase Storage
-        try:
-            service_supabase = create_client(settings.SUPABASE_URL, settings.SUPABASE_SERVICE_ROLE_KEY)
-            storage_response = service_supabase.storage.from_('user-documents').upload(
-                path=file_path,
-                file=file_content,
-                file_options={
-                    'content-type': file.content_type,
-                    'upsert': False
-                }
-            )
+        def upload_to_storage():
+            try:
+                storage_response = service_supabase.storage.from_('user-documents').upload(
+                    path=file_path,
+                    file=file_content,
+                    file_options={
+                        'content-type': file.content_type,
+                        'upsert': False
+                    }
+                )
+            except Exception as e:
+                raise HTTPException(status_code=500, detail=f"Storage upload failed: {str(e)}")
             if not storage_response:
                 raise HTTPException(status_code=500, detail="Failed to upload file to storage")
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=f"Storage upload failed: {str(e)}")
-
-        # Extract text from file
-        if file_extension == 'pdf':
-            full_text = extract_text_from_pdf(file_content)
-        elif file_extension == 'docx':
-            full_text = extract_text_from_docx(file_content)
-        else:
-            raise HTTPException(status_code=400, detail="Unsupported file type")
-
-        if not full_text.strip():
-            raise HTTPException(status_code=400, detail="No text content could be extracted from the file")
-
-        # Split text into chunks using LangChain
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1000,
-            chunk_overlap=150,
-            length_function=len
-        )
-        chunks = text_splitter.split_text(full_text)
-        print(f"Split text into {len(chunks)} chunks")
-
-        # Generate embeddings for each chunk
-        if not hasattr(settings, 'OPENAI_API_KEY') or not settings.OPENAI_API_KEY:
-            raise HTTPException(status_code=500, detail="OpenAI API key not configured")
 
-        client = openai.OpenAI(api_key=settings.OPENAI_API_KEY)
-        embeddings = []
+        # The upload and text extraction are independent; run both off the event loop at once
+        loop = asyncio.get_running_loop()
+        _, full_text = await asyncio.gather(
+            asyncio.to_thread(upload_to_storage),
+            loop.run_in_executor(_extraction_pool, extract_text, file_content)
+        )
 
-        for i, chunk in enumerate(chunks):
-            print(f"Generating embedding for chunk {i+1}/{len(chunks)}")
-            response = client.embeddings.create(
-                input=chunk,
-                model="text-embedding-3-small"
-            )
-            embeddings.append(response.data[0].embedding)
-
-        # Prepare data for insertion
-        data_to_insert = []
-        for i, (chunk, embedding) in enumerate(zip(chunks, embeddings)):
-            data_to_insert.append({
-                "user_id": user_id,
-                "content": chunk,
-                "embedding": embedding,
-                "course_name": course_name,
-                "original_file_name": file.filename,
-                "file_path": file_path,
-                "chunk_index": i,
-                "total_chunks": len(chunks)
-            })
-
-        # Insert all chunks into documents table
-        service_supabase.table("documents").insert(data_to_insert).execute()
+        chunks_created = await index_document_text(full_text, user_id, google_id, course_name, file.filename, file_path)
 
         return {
             "message": "File processed and saved successfully",
-            "chunks_created": len(chunks),
+            "chunks_created": chunks_created,
             "filename": file.filename,
             "course_name": course_name
         }
@@ -273,6 +309,113 @@ async def upload_document(
         print(f"Upload failed: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Upload failed: {str(e)}")
 
+@router.post("/signed-upload")
+async def create_signed_upload(
+    request: SignedUploadRequest,
+    user: Dict[str, Any] = Depends(verify_supabase_token)
+):
+    """
+    Create a signed URL the client can upload a file to directly.
+    The file bytes go straight to Supabase Storage; call /process afterwards.
+    """
+    try:
+        google_id = user["google_id"]
+
+        # Reject unsupported files before handing out an upload URL
+        file_extension = request.file_name.split('.')[-1].lower()
+        get_text_extractor(file_extension)
+
+        file_path = f"{google_id}/{uuid.uuid4()}.{file_extension}"
+
+        service_supabase = get_supabase_service_client()
+        signed = await asyncio.to_thread(
+            service_supabase.storage.from_('user-documents').create_signed_upload_url,
+            file_path
+        )
+
+        return {
+            "file_path": file_path,
+            "signed_url": signed["signed_url"],
+            "token": signed["token"]
+        }
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to create upload URL: {str(e)}")
+
+# Storage paths whose /process request is still running in this process
+_processing_paths: Set[str] = set()
+
+@router.post("/process")
+async def process_uploaded_document(
+    request: ProcessDocumentRequest,
+    user: Dict[str, Any] = Depends(verify_supabase_token)
+):
+    """Extract, chunk, embed and save a document the client uploaded through /signed-upload"""
+    try:
+        google_id = user["google_id"]
+
+        # Only files under the user's own storage folder may be processed
+        if ".." in request.file_path:
+            raise HTTPException(status_code=400, detail="Invalid file path")
+        if not request.file_path.startswith(f"{google_id}/"):
+            raise HTTPException(status_code=403, detail="Not authorized to process this file")
+
+        extract_text = get_text_extractor(request.file_path.split('.')[-1].lower())
+
+        service_supabase = get_supabase_service_client()
+        user_id, existing = await asyncio.gather(
+            get_user_id(google_id),
+            asyncio.to_thread(
+                service_supabase.table('documents')
+                .select('course_name, original_file_name, total_chunks')
+                .eq('file_path', request.file_path)
+                .limit(1)
+                .execute
+            )
+        )
+
+        # A retried request must not index the same upload twice
+        if request.file_path in _processing_paths:
+            raise HTTPException(status_code=409, detail="File is already being processed")
+        if existing.data:
+            document = existing.data[0]
+            return {
+                "message": "File already processed",
+                "chunks_created": document['total_chunks'],
+                "filename": document['original_file_name'],
+                "course_name": document['course_name']
+            }
+
+        _processing_paths.add(request.file_path)
+        try:
+            file_content = await asyncio.to_thread(
+                service_supabase.storage.from_('user-documents').download, request.file_path
+            )
+
+            loop = asyncio.get_running_loop()
+            full_text = await loop.run_in_executor(_extraction_pool, extract_text, file_content)
+
+            chunks_created = await index_document_text(
+                full_text, user_id, google_id, request.course_name, request.original_file_name, request.file_path
+            )
+        finally:
+            _processing_paths.discard(request.file_path)
+
+        return {
+            "message": "File processed and saved successfully",
+            "chunks_created": chunks_created,
+            "filename": request.original_file_name,
+            "course_name": request.course_name
+        }
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Processing failed: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Processing failed: {str(e)}")
+
 @router.delete("/{document_id}")
 async def delete_document(
     document_id: str,
@@ -286,19 +429,13 @@ async def delete_document(
         email = user.get("email", "")
 
         # Get user
-        user_id = get_user_id(google_id)
+        user_id = await get_user_id(google_id)
 
         # Get document info
         doc_data = supabase.table('documents').select('file_path, user_id').eq('id', document_id).single().execute()
         
-        # Handle both dictionary and object response formats for doc_data
-        if isinstance(doc_data, dict):
-            doc_info = doc_data.get('data')
-        elif hasattr(doc_data, 'data'):
-            doc_info = doc_data.data
-        else:
-            doc_info = None
-            
+        doc_info = doc_data.data
+
         if not doc_info:
             raise HTTPException(status_code=404, detail="Document not found")
 
@@ -317,6 +454,9 @@ async def delete_document(
 
         # Delete from database
         supabase.table('documents').delete().eq('id', document_id).execute()
+        invalidate(document_list_cache, user_id)
+        # Cached study answers may quote the deleted document
+        semantic_cache.invalidate(google_id)
 
         return {"message": "Document deleted successfully"}
 
@@ -338,19 +478,13 @@ async def get_document(
         email = user.get("email", "")
 
         # Get user
-        user_id = get_user_id(google_id)
+        user_id = await get_user_id(google_id)
 
         # Get document
         doc_data = supabase.table('documents').select('*').eq('id', document_id).single().execute()
         
-        # Handle both dictionary and object response formats for doc_data
-        if isinstance(doc_data, dict):
-            doc_info = doc_data.get('data')
-        elif hasattr(doc_data, 'data'):
-            doc_info = doc_data.data
-        else:
-            doc_info = None
-            
+        doc_info = doc_data.data
+
         if not doc_info:
             raise HTTPException(status_code=404, detail="Document not found")
 
@@ -12,7 +12,7 @@ async def get_gmail_info(user: Dict[str, Any] = Depends(verify_supabase_token)):
     """
     try:
         # Check if user has Gmail connected
-        connection_info = check_gmail_connection(user["google_id"])
+        connection_info = await check_gmail_connection(user["google_id"])
 
         if not connection_info["connected"]:
             raise HTTPException(status_code=404, detail="Gmail not connected")
@@ -0,0 +1,17 @@
+"""
+Short-lived in-process caches for read-mostly list endpoints.
+Entries are dropped by the endpoints that change the underlying rows.
+"""
+
+from typing import Hashable
+from cachetools import TTLCache
+
+# Conversation list per google_id (includes message counts)
+conversation_list_cache = TTLCache(maxsize=10_000, ttl=60)
+
+# Document list per internal user_id
+document_list_cache = TTLCache(maxsize=10_000, ttl=60)
+
+def invalidate(cache: TTLCache, key: Hashable) -> None:
+    """Drop a cached entry after a write so the next read goes to the database."""
+    cache.pop(key, None)
@@ -3,9 +3,12 @@ Chat memory system using database
 Stores and retrieves conversation history for persistent chat
 """
 
-from typing import List, Dict, Any, Optional
+import threading
+from collections import deque
+from typing import List, Dict, Any, Optional, Tuple
 from datetime import datetime
-from app.core.db_client import get_messages, add_message as db_add_message, clear_messages
+from cachetools import TTLCache
+from app.core.db_client import get_messages, get_message_stats, add_message as db_add_message, add_messages_bulk, clear_messages, get_conversation_messages_after
 
 class ChatMemory:
     """
@@ -13,7 +16,45 @@ class ChatMemory:
     """
 
     def __init__(self):
-        pass
+        # Formatted LLM context lines per user, keyed by limit. Writes through this
+        # class append to them, so consecutive turns don't re-read and re-format
+        # history; writes made elsewhere must call invalidate_user.
+        self._context_lines: TTLCache = TTLCache(maxsize=1024, ttl=300)
+        # Formatted context per conversation as (last message id, lines, joined text);
+        # each turn only fetches messages newer than the last one seen
+        self._conversation_lines: TTLCache = TTLCache(maxsize=1024, ttl=300)
+        # Callers run in worker threads; guards both caches and the deques in them
+        self._lock = threading.Lock()
+        # Bumped on every write, so a history read that raced one isn't cached
+        self._writes = 0
+
+    @staticmethod
+    def _format_line(role: str, content: str, timestamp: Any) -> str:
+        return f"[{role.upper()}] ({timestamp}): {content}"
+
+    def _append_context(self, user_id: int, messages: List[Tuple[str, str]], timestamps: List[datetime]):
+        with self._lock:
+            self._writes += 1
+            cached = self._context_lines.get(user_id)
+            if cached is None:
+                return
+            for lines in cached.values():
+                lines.extend(
+                    self._format_line(role, content, timestamp)
+                    for (role, content), timestamp in zip(messages, timestamps)
+                )
+
+    def invalidate_user(self, user_id: int):
+        """Drop the cached history of a user whose messages were written elsewhere"""
+        with self._lock:
+            self._writes += 1
+            self._context_lines.pop(user_id, None)
+
+    def invalidate_conversation(self, conversation_id: str):
+        """Drop the cached context of a conversation whose messages were deleted"""
+        with self._lock:
+            for key in [key for key in self._conversation_lines if key[0] == conversation_id]:
+                self._conversation_lines.pop(key, None)
 
     def add_message(self, user_id: int, role: str, content: str) -> bool:
         """
@@ -28,12 +69,32 @@ class ChatMemory:
             bool: True if successful, False otherwise
         """
         try:
-            db_add_message(user_id, role, content)
+            created_at = db_add_message(user_id, role, content)
+            self._append_context(user_id, [(role, content)], [created_at])
             return True
         except Exception as e:
             print(f"Error adding message: {e}")
             return False
 
+    def add_messages(self, user_id: int, messages: List[Tuple[str, str]]) -> bool:
+        """
+        Add several messages to the conversation history in one database write.
+
+        Args:
+            user_id (int): The user's ID from database
+            messages (List[Tuple[str, str]]): (role, content) pairs in chronological order
+
+        Returns:
+            bool: True if successful, False otherwise
+        """
+        try:
+            created_at = add_messages_bulk([(user_id, role, content) for role, content in messages])
+            self._append_context(user_id, messages, created_at)
+            return True
+        except Exception as e:
+            print(f"Error adding messages: {e}")
+            return False
+
     def get_conversation_history(self, user_id: int, limit: int = 50) -> List[Dict[str, Any]]:
         """
         Get the conversation history for a user.
@@ -46,8 +107,7 @@ class ChatMemory:
             List[Dict[str, Any]]: List of messages in chronological order
         """
         try:
-            messages = get_messages(user_id)
-            return messages[-limit:] if len(messages) > limit else messages
+            return get_messages(user_id, limit=limit)
         except Exception as e:
             print(f"Error retrieving conversation history: {e}")
             return []
@@ -64,8 +124,7 @@ class ChatMemory:
             List[Dict[str, Any]]: List of recent messages in chronological order
         """
         try:
-            messages = get_messages(user_id)
-            return messages[-count:] if len(messages) > count else messages
+            return get_messages(user_id, limit=count)
         except Exception as e:
             print(f"Error retrieving recent messages: {e}")
             return []
@@ -82,6 +141,7 @@ class ChatMemory:
         """
         try:
             clear_messages(user_id)
+            self.invalidate_user(user_id)
             return True
         except Exception as e:
             print(f"Error clearing conversation history: {e}")
@@ -98,20 +158,60 @@ class ChatMemory:
         Returns:
             str: Formatted conversation history
         """
+        with self._lock:
+            lines = self._context_lines.get(user_id, {}).get(limit)
+            if lines is not None:
+                return "\n".join(lines)
+            writes = self._writes
+
         messages = self.get_recent_messages(user_id, limit)
 
         if not messages:
             return "No previous conversation history."
 
-        formatted_messages = []
-        for message in messages:
-            role = message['role'].upper()
-            content = message['content']
-            timestamp = message['created_at']
+        lines = deque(
+            (self._format_line(message['role'], message['content'], message['created_at']) for message in messages),
+            maxlen=limit
+        )
+        text = "\n".join(lines)
+        with self._lock:
+            # A write landed while we were reading; these lines may already miss it
+            if self._writes == writes:
+                self._context_lines.setdefault(user_id, {})[limit] = lines
+        return text
+
+    def format_conversation_context(self, conversation_id: str, limit: int = 10) -> str:
+        """
+        Format the last messages of a conversation for inclusion in LLM context.
+
+        Lines carry no timestamps, so the same history always formats to the
+        same text and the prompt prefix stays stable across turns.
 
-            formatted_messages.append(f"[{role}] ({timestamp}): {content}")
+        Args:
+            conversation_id (str): The conversation's ID
+            limit (int): Maximum number of messages to include (default: 10)
+
+        Returns:
+            str: Formatted conversation history, empty if there is none
+        """
+        with self._lock:
+            last_id, cached_lines, cached_text = self._conversation_lines.get((conversation_id, limit), (0, (), ""))
 
-        return "\n".join(formatted_messages)
+        new_messages = get_conversation_messages_after(conversation_id, last_id, limit)
+        if not new_messages:
+            # Nothing new since the last turn: reuse the exact same text
+            return cached_text
+
+        # The cached deque is shared with concurrent requests, so extend a copy
+        lines = deque(cached_lines, maxlen=limit)
+        for message in new_messages:
+            lines.append(f"{'User' if message['role'] == 'user' else 'Assistant'}: {message['content']}")
+            last_id = message['id']
+
+        text = "\n".join(lines)
+        with self._lock:
+            self._conversation_lines[(conversation_id, limit)] = (last_id, lines, text)
+        return text
 
     def get_conversation_summary(self, user_id: int) -> Dict[str, Any]:
         """
@@ -124,17 +224,13 @@ class ChatMemory:
             Dict[str, Any]: Conversation statistics
         """
         try:
-            messages = get_messages(user_id)
-            total_messages = len(messages)
-            user_messages = len([m for m in messages if m['role'] == 'user'])
-            ai_messages = len([m for m in messages if m['role'] == 'ai'])
-            last_message_time = messages[-1]['created_at'] if messages else None
+            stats = get_message_stats(user_id)
 
             return {
-                "total_messages": total_messages,
-                "user_messages": user_messages,
-                "ai_messages": ai_messages,
-                "last_message_time": last_message_time,
+                "total_messages": stats['total_messages'],
+                "user_messages": stats['user_messages'],
+                "ai_messages": stats['ai_messages'],
+                "last_message_time": stats['last_message_time'],
                 "user_id": user_id
             }
 
@@ -152,6 +248,10 @@ def add_message(user_id: int, role: str, content: str) -> bool:
     """Add a message to chat history."""
     return chat_memory.add_message(user_id, role, content)
 
+def add_messages(user_id: int, messages: List[Tuple[str, str]]) -> bool:
+    """Add several messages to chat history at once."""
+    return chat_memory.add_messages(user_id, messages)
+
 def get_conversation_history(user_id: int, limit: int = 50) -> List[Dict[str, Any]]:
     """Get conversation history for a user."""
     return chat_memory.get_conversation_history(user_id, limit)
@@ -163,3 +263,15 @@ def get_recent_messages(user_id: int, count: int = 10) -> List[Dict[str, Any]]:
 def format_conversation_for_llm(user_id: int, limit: int = 20) -> str:
     """Format conversation for LLM context."""
     return chat_memory.format_conversation_for_llm(user_id, limit)
+
+def format_conversation_context(conversation_id: str, limit: int = 10) -> str:
+    """Format a conversation's recent messages for LLM context."""
+    return chat_memory.format_conversation_context(conversation_id, limit)
+
+def invalidate_user_history(user_id: int):
+    """Drop cached history for a user after writing their messages directly."""
+    chat_memory.invalidate_user(user_id)
+
+def invalidate_conversation_history(conversation_id: str):
+    """Drop cached context for a conversation after deleting its messages."""
+    chat_memory.invalidate_conversation(conversation_id)
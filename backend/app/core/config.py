@@ -19,6 +19,13 @@ class Settings:
     MISTRAL_MODEL: str = os.getenv("MISTRAL_MODEL", "mistral-large-latest")
     OPENROUTER_MODEL: str = os.getenv("OPENROUTER_MODEL", "deepseek/deepseek-chat-v3.1:free")
 
+    # Serve cached replies for paraphrased study/career questions (see app/core/semantic_cache.py)
+    SEMANTIC_CACHE_ENABLED: bool = os.getenv("SEMANTIC_CACHE_ENABLED", "false").lower() == "true"
+
+    # Study-material contexts up to this many characters answer lookup-style questions
+    # directly, without a synthesis LLM call (0 disables)
+    SYNTHESIS_SHORT_CIRCUIT_MAX_CHARS: int = int(os.getenv("SYNTHESIS_SHORT_CIRCUIT_MAX_CHARS", "800"))
+
     TAVILY_API_KEY: str = os.getenv("TAVILY_API_KEY", "")
     API_V1_STR: str = "/api/v1"
     PROJECT_NAME: str = "StudyRobo"
@@ -27,9 +34,13 @@ class Settings:
     SUPABASE_URL: str = os.getenv("SUPABASE_URL", "")
     SUPABASE_ANON_KEY: str = os.getenv("SUPABASE_ANON_KEY", "")
     SUPABASE_SERVICE_ROLE_KEY: str = os.getenv("SUPABASE_SERVICE_ROLE_KEY", "")
+    SUPABASE_JWT_SECRET: str = os.getenv("SUPABASE_JWT_SECRET", "")  # Project Settings > API > JWT Secret
 
     # Google OAuth (now handled by Supabase, but keeping for reference)
     GOOGLE_CLIENT_ID: str = os.getenv("GOOGLE_CLIENT_ID", "")
     GOOGLE_CLIENT_SECRET: str = os.getenv("GOOGLE_CLIENT_SECRET", "")
 
+    # Frontend origin, used to build OAuth redirect URIs
+    FRONTEND_URL: str = os.getenv("FRONTEND_URL", "http://localhost:3000")
+
 settings = Settings()
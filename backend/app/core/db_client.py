@@ -4,11 +4,18 @@ Uses PostgreSQL with psycopg2 for all database operations
 """
 
 import os
+import atexit
+import hashlib
+import threading
+import httpx
 import psycopg2
-from psycopg2.extras import RealDictCursor
-from typing import Optional, List, Dict, Any
+from psycopg2.extras import RealDictCursor, execute_values
+from psycopg2.pool import ThreadedConnectionPool
+from typing import Optional, List, Dict, Any, Tuple
+from datetime import datetime
 from contextlib import contextmanager
 from dotenv import load_dotenv
+from cachetools import TTLCache
 
 # Load environment variables
 load_dotenv()
@@ -19,26 +26,111 @@ database_url = os.environ.get("DATABASE_URL")
 if not database_url:
     raise ValueError("Missing DATABASE_URL. Please set DATABASE_URL in your .env file.")
 
-@contextmanager
-def get_db_connection():
-    """Get a database connection"""
-    conn = psycopg2.connect(database_url)
+# Reuse connections across queries instead of paying TCP + TLS + auth on each one.
+# Queries run in worker threads, so the pool must be thread-safe; the semaphore makes
+# callers wait for a free connection rather than fail when the pool is exhausted.
+DB_POOL_MIN_CONNECTIONS = 1
+DB_POOL_MAX_CONNECTIONS = 20
+
+# Hot statements are prepared once per pooled connection so the server skips the
+# parse/plan step on every call. Placeholders use PostgreSQL's $n form; run them
+# with execute_prepared.
+_PREPARED_STATEMENTS = {
+    "add_msg": "INSERT INTO messages (user_id, role, content) VALUES ($1, $2, $3) RETURNING created_at",
+    "get_recent_msgs": """
+        SELECT role, content, created_at FROM (
+            SELECT role, content, created_at FROM messages
+            WHERE user_id = $1 AND ($2::timestamptz IS NULL OR created_at < $2::timestamptz)
+            ORDER BY created_at DESC
+            LIMIT $3
+        ) recent
+        ORDER BY created_at
+    """
+}
+
+class PreparingConnectionPool(ThreadedConnectionPool):
+    """Thread-safe pool that prepares the hot statements on each new connection"""
+
+    def _connect(self, key=None):
+        conn = super()._connect(key)
+        with conn.cursor() as cursor:
+            for name, statement in _PREPARED_STATEMENTS.items():
+                cursor.execute(f"PREPARE {name} AS {statement}")
+        conn.commit()
+        return conn
+
+_pool: Optional[ThreadedConnectionPool] = None
+_pool_lock = threading.Lock()
+_pool_slots = threading.BoundedSemaphore(DB_POOL_MAX_CONNECTIONS)
+
+def get_pool() -> ThreadedConnectionPool:
+    """Create the connection pool on first use"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = PreparingConnectionPool(DB_POOL_MIN_CONNECTIONS, DB_POOL_MAX_CONNECTIONS, database_url)
+    return _pool
+
+def warm_up_pool():
+    """Open the pool's initial connections ahead of the first request"""
     try:
-        yield conn
-    finally:
-        conn.close()
+        get_pool()
+    except psycopg2.Error as e:
+        print(f"Database pool warm-up failed: {e}")
+
+def close_pool():
+    """Close all pooled connections"""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.closeall()
+            _pool = None
+
+# Scripts that import db_client outside the app don't get the shutdown hook
+atexit.register(close_pool)
+
+@contextmanager
+def get_db_connection(autocommit: bool = False):
+    """
+    Get a pooled database connection, committing on success and rolling back on error.
+
+    With autocommit, each statement is its own transaction and no BEGIN/COMMIT
+    round trips are sent.
+    """
+    with _pool_slots:
+        pool = get_pool()
+        conn = pool.getconn()
+        conn.autocommit = autocommit
+        try:
+            yield conn
+            conn.commit()
+        except Exception:
+            if not conn.closed:
+                conn.rollback()
+            raise
+        finally:
+            if not conn.closed:
+                conn.autocommit = False
+            # Drop connections the server closed so they are not handed out again
+            pool.putconn(conn, close=bool(conn.closed))
 
 def execute_query(query: str, params: tuple = None, fetch: bool = True) -> Optional[List[Dict[str, Any]]]:
     """Execute a query and optionally fetch results"""
-    with get_db_connection() as conn:
+    # A single query string is atomic on its own (several statements in one string
+    # still run as one implicit transaction), so skip the explicit BEGIN/COMMIT
+    with get_db_connection(autocommit=True) as conn:
         with conn.cursor(cursor_factory=RealDictCursor) as cursor:
             cursor.execute(query, params)
             result = None
             if fetch:
                 result = [dict(row) for row in cursor.fetchall()]
-            conn.commit()
             return result
-    return None
+
+def execute_prepared(name: str, params: tuple = (), fetch: bool = True) -> Optional[List[Dict[str, Any]]]:
+    """Execute one of the statements in _PREPARED_STATEMENTS and optionally fetch results"""
+    placeholders = ", ".join(["%s"] * len(params))
+    return execute_query(f"EXECUTE {name} ({placeholders})", params, fetch=fetch)
 
 def get_user_by_google_id(google_id: str) -> Optional[Dict[str, Any]]:
     """Get user by Google ID"""
@@ -52,10 +144,26 @@ def create_user(google_id: str, email: str, name: str) -> int:
     result = execute_query(query, (google_id, email, name), fetch=False)
     return result[0]['id'] if result else None
 
-def get_messages(user_id: int) -> List[Dict[str, Any]]:
-    """Get all messages for a user (legacy function for compatibility)"""
-    query = "SELECT role, content, created_at FROM messages WHERE user_id = %s ORDER BY created_at"
-    return execute_query(query, (user_id,)) or []
+def get_messages(user_id: int, limit: Optional[int] = None, before: Optional[datetime] = None) -> List[Dict[str, Any]]:
+    """
+    Get messages for a user (legacy function for compatibility).
+
+    With limit, only the most recent messages (created before `before`, if given)
+    are fetched; they are still returned oldest first.
+    """
+    return execute_prepared("get_recent_msgs", (user_id, before, limit)) or []
+
+def get_message_stats(user_id: int) -> Dict[str, Any]:
+    """Get message counts and the latest message time for a user in one aggregate query"""
+    query = """
+    SELECT COUNT(*) AS total_messages,
+           COUNT(*) FILTER (WHERE role = 'user') AS user_messages,
+           COUNT(*) FILTER (WHERE role = 'ai') AS ai_messages,
+           MAX(created_at) AS last_message_time
+    FROM messages
+    WHERE user_id = %s
+    """
+    return execute_query(query, (user_id,))[0]
 
 def get_messages_by_conversation(conversation_id: str, google_id: str = None) -> List[Dict[str, Any]]:
     """Get all messages for a specific conversation, optionally filtered by user ownership"""
@@ -75,37 +183,109 @@ def get_messages_by_conversation(conversation_id: str, google_id: str = None) ->
         query = "SELECT role, content, created_at FROM messages WHERE conversation_id = %s ORDER BY created_at"
         return execute_query(query, (conversation_id,)) or []
 
-def add_message(user_id: int, role: str, content: str):
-    """Add a message for a user (legacy function for compatibility)"""
-    query = "INSERT INTO messages (user_id, role, content) VALUES (%s, %s, %s)"
-    execute_query(query, (user_id, role, content), fetch=False)
+def get_conversation_messages_after(conversation_id: str, after_id: int, limit: int) -> List[Dict[str, Any]]:
+    """Get up to `limit` of the newest messages in a conversation with id above after_id, oldest first"""
+    query = """
+    SELECT id, role, content FROM (
+        SELECT id, role, content FROM messages
+        WHERE conversation_id = %s AND id > %s
+        ORDER BY id DESC
+        LIMIT %s
+    ) recent
+    ORDER BY id
+    """
+    return execute_query(query, (conversation_id, after_id, limit)) or []
+
+def get_owned_conversation_messages(conversation_id: str, google_id: str) -> List[Dict[str, Any]]:
+    """
+    Get all messages for a conversation owned by the given user.
+
+    Existence, ownership and messages come back from a single query; raises
+    ValueError if the conversation is not found or belongs to another user.
+    """
+    query = """
+    WITH c AS (
+        SELECT c.id, u.google_id AS owner_google_id
+        FROM conversations c
+        LEFT JOIN users u ON c.user_id = u.id
+        WHERE c.id = %s
+    )
+    SELECT c.owner_google_id, m.id, m.role, m.content, m.created_at::text as created_at
+    FROM c
+    LEFT JOIN messages m ON m.conversation_id = c.id
+    ORDER BY m.created_at
+    """
+    rows = execute_query(query, (conversation_id,))
+    if not rows:
+        raise ValueError("Conversation not found")
+    if rows[0]['owner_google_id'] != google_id:
+        raise ValueError("Access denied")
+
+    # A conversation without messages yields one row with NULL message columns
+    return [
+        {"id": row['id'], "role": row['role'], "content": row['content'], "created_at": row['created_at']}
+        for row in rows if row['id'] is not None
+    ]
+
+def add_message(user_id: int, role: str, content: str) -> datetime:
+    """Add a message for a user and return its created_at (legacy function for compatibility)"""
+    return execute_prepared("add_msg", (user_id, role, content))[0]['created_at']
+
+def add_messages_bulk(rows: List[Tuple[int, str, str]]) -> List[datetime]:
+    """
+    Add several (user_id, role, content) messages in a single INSERT (legacy function for compatibility).
+
+    Returns the created_at of each row, in the given order.
+    """
+    with get_db_connection() as conn:
+        with conn.cursor() as cursor:
+            # clock_timestamp() advances per row, keeping created_at in the given order
+            inserted = execute_values(
+                cursor,
+                "INSERT INTO messages (user_id, role, content, created_at) VALUES %s RETURNING created_at",
+                rows,
+                template="(%s, %s, %s, clock_timestamp())",
+                page_size=500,
+                fetch=True
+            )
+    return [row[0] for row in inserted]
 
-def add_message_to_conversation(conversation_id: str, role: str, content: str):
-    """Add a message to a specific conversation"""
-    # First get user_id from conversation
-    user_query = "SELECT user_id FROM conversations WHERE id = %s"
-    result = execute_query(user_query, (conversation_id,))
+def add_message_to_conversation(conversation_id: str, role: str, content: str) -> int:
+    """Add a message to a specific conversation and return the owner's user_id"""
+    # Take the owner's user_id from the conversation row in the same statement
+    query = """
+    INSERT INTO messages (conversation_id, user_id, role, content)
+    SELECT id, user_id, %s, %s FROM conversations WHERE id = %s
+    RETURNING user_id
+    """
+    result = execute_query(query, (role, content, conversation_id))
     if not result:
         raise ValueError(f"Conversation {conversation_id} not found")
+    return result[0]['user_id']
 
-    user_id = result[0]['user_id']
-    
-    # Validate that user_id is an integer (not a Google ID string)
-    if not isinstance(user_id, int):
-        # Try to convert to int, if it fails, we need to look up the correct user_id
-        try:
-            user_id = int(user_id)
-        except (ValueError, TypeError):
-            # This might be a Google ID, try to find the corresponding user
-            google_id = str(user_id)
-            user_lookup = execute_query("SELECT id FROM users WHERE google_id = %s", (google_id,))
-            if user_lookup:
-                user_id = user_lookup[0]['id']
-            else:
-                raise ValueError(f"Invalid user_id in conversation {conversation_id}: {user_id}")
-    
-    query = "INSERT INTO messages (conversation_id, user_id, role, content) VALUES (%s, %s, %s, %s)"
-    execute_query(query, (conversation_id, user_id, role, content), fetch=False)
+def add_messages_to_conversation(conversation_id: str, messages: List[Tuple[str, str]]):
+    """Add several (role, content) messages to a conversation in a single INSERT"""
+    rows = [(conversation_id, position, role, content) for position, (role, content) in enumerate(messages)]
+    with get_db_connection() as conn:
+        with conn.cursor() as cursor:
+            # Sorting by position before clock_timestamp() is evaluated keeps
+            # created_at in the given order
+            inserted = execute_values(
+                cursor,
+                """
+                INSERT INTO messages (conversation_id, user_id, role, content, created_at)
+                SELECT c.id, c.user_id, v.role, v.content, clock_timestamp()
+                FROM (VALUES %s) AS v(conversation_id, position, role, content)
+                JOIN conversations c ON c.id = v.conversation_id::uuid
+                ORDER BY v.position
+                RETURNING id
+                """,
+                rows,
+                page_size=500,
+                fetch=True
+            )
+    if messages and not inserted:
+        raise ValueError(f"Conversation {conversation_id} not found")
 
 def mark_attendance(user_id: int, course_name: str):
     """Mark attendance for a user"""
@@ -117,57 +297,70 @@ def insert_document(content: str, course_name: str, embedding: List[float]):
     query = "INSERT INTO documents (content, course_name, embedding) VALUES (%s, %s, %s)"
     execute_query(query, (content, course_name, embedding), fetch=False)
 
+# Candidate list size for HNSW searches; higher trades speed for recall
+HNSW_EF_SEARCH = 40
+
 def search_documents(query_embedding: List[float], match_threshold: float = 0.3, match_count: int = 4, google_id: str = None) -> List[Dict[str, Any]]:
     """Search documents using direct SQL queries with user filtering"""
     try:
+        params = {
+            "google_id": google_id,
+            "embedding": query_embedding,
+            "threshold": match_threshold,
+            "count": match_count
+        }
+        # ORDER BY the bare distance operator so pgvector can answer the top-k from the
+        # HNSW index; the similarity threshold is applied to those k rows afterwards
         if google_id:
-            # Get user_id from google_id
-            user_query = "SELECT id, course_name FROM users WHERE google_id = %s"
-            user_result = execute_query(user_query, (google_id,))
-            if not user_result:
-                return []
-
-            user_id = user_result[0]['id']
-            user_course = user_result[0]['course_name']
-
-            # Search with user filtering
             query = """
-            SELECT
-                id,
-                content,
-                1 - (embedding <=> %s::vector) as similarity,
-                course_name,
-                original_file_name as file_name,
-                file_type,
-                (user_id IS NULL) as is_global
-            FROM documents
-            WHERE 1 - (embedding <=> %s::vector) > %s
-            AND (
-                user_id = %s
-                OR (user_id IS NULL AND course_name = %s)
-                OR (user_id IS NULL AND course_name IS NULL)
+            SET LOCAL hnsw.ef_search = %(ef_search)s;
+            WITH u AS (
+                SELECT id, course_name FROM users WHERE google_id = %(google_id)s
             )
+            SELECT * FROM (
+                SELECT
+                    d.id,
+                    d.content,
+                    1 - (d.embedding <=> %(embedding)s::vector) as similarity,
+                    d.course_name,
+                    d.original_file_name as file_name,
+                    d.file_type,
+                    (d.user_id IS NULL) as is_global
+                FROM documents d
+                WHERE EXISTS (SELECT 1 FROM u)
+                AND (
+                    d.user_id = (SELECT id FROM u)
+                    OR (d.user_id IS NULL AND d.course_name = (SELECT course_name FROM u))
+                    OR (d.user_id IS NULL AND d.course_name IS NULL)
+                )
+                ORDER BY d.embedding <=> %(embedding)s::vector
+                LIMIT %(count)s
+            ) nearest
+            WHERE similarity > %(threshold)s
             ORDER BY similarity DESC
-            LIMIT %s
             """
-            return execute_query(query, (query_embedding, query_embedding, match_threshold, user_id, user_course, match_count)) or []
         else:
             # Fallback for no user context - search all documents
             query = """
-            SELECT
-                id,
-                content,
-                1 - (embedding <=> %s::vector) as similarity,
-                course_name,
-                original_file_name as file_name,
-                file_type,
-                (user_id IS NULL) as is_global
-            FROM documents
-            WHERE 1 - (embedding <=> %s::vector) > %s
+            SET LOCAL hnsw.ef_search = %(ef_search)s;
+            SELECT * FROM (
+                SELECT
+                    d.id,
+                    d.content,
+                    1 - (d.embedding <=> %(embedding)s::vector) as similarity,
+                    d.course_name,
+                    d.original_file_name as file_name,
+                    d.file_type,
+                    (d.user_id IS NULL) as is_global
+                FROM documents d
+                ORDER BY d.embedding <=> %(embedding)s::vector
+                LIMIT %(count)s
+            ) nearest
+            WHERE similarity > %(threshold)s
             ORDER BY similarity DESC
-            LIMIT %s
             """
-            return execute_query(query, (query_embedding, query_embedding, match_threshold, match_count)) or []
+        params["ef_search"] = HNSW_EF_SEARCH
+        return execute_query(query, params) or []
     except Exception as e:
         print(f"Error in search_documents: {e}")
         return []
@@ -195,76 +388,88 @@ def create_conversation(google_id: str, title: str = "New Chat") -> str:
 
 def get_user_conversations(google_id: str) -> List[Dict[str, Any]]:
     """Get all conversations for a user"""
+    # message_count is kept up to date by a trigger on messages, so listing
+    # conversations doesn't touch the messages table
     query = """
-    SELECT c.id, c.title, c.created_at::text as created_at,
-           COUNT(m.id) as message_count
+    SELECT c.id, c.title, c.created_at::text as created_at, c.message_count
     FROM conversations c
-    LEFT JOIN messages m ON c.id = m.conversation_id
     JOIN users u ON c.user_id = u.id
     WHERE u.google_id = %s
-    GROUP BY c.id, c.title, c.created_at
     ORDER BY c.created_at DESC
     """
     return execute_query(query, (google_id,)) or []
 
-def delete_conversation(conversation_id: str, google_id: str):
-    """Delete a conversation and all its messages"""
-    # Verify user owns the conversation
-    verify_query = """
-    SELECT 1 FROM conversations c
-    JOIN users u ON c.user_id = u.id
-    WHERE c.id = %s AND u.google_id = %s
+def delete_conversation(conversation_id: str, google_id: str) -> int:
+    """Delete a conversation and all its messages, returning the owner's user_id"""
+    # Ownership check and delete in one statement; messages go with the
+    # conversation through the ON DELETE CASCADE foreign key
+    query = """
+    DELETE FROM conversations c
+    USING users u
+    WHERE c.id = %s AND c.user_id = u.id AND u.google_id = %s
+    RETURNING c.user_id
     """
-    result = execute_query(verify_query, (conversation_id, google_id))
+    result = execute_query(query, (conversation_id, google_id))
     if not result:
         raise ValueError("Conversation not found or access denied")
-
-    # Delete messages first, then conversation
-    delete_messages_query = "DELETE FROM messages WHERE conversation_id = %s"
-    delete_conv_query = "DELETE FROM conversations WHERE id = %s"
-
-    execute_query(delete_messages_query, (conversation_id,), fetch=False)
-    execute_query(delete_conv_query, (conversation_id,), fetch=False)
+    return result[0]['user_id']
 
 def update_conversation_title(conversation_id: str, google_id: str, title: str):
     """Update conversation title"""
-    # Verify user owns the conversation
-    verify_query = """
-    SELECT 1 FROM conversations c
-    JOIN users u ON c.user_id = u.id
-    WHERE c.id = %s AND u.google_id = %s
+    # Ownership check and update in one statement
+    query = """
+    UPDATE conversations c
+    SET title = %s
+    FROM users u
+    WHERE c.id = %s AND c.user_id = u.id AND u.google_id = %s
+    RETURNING 1
     """
-    result = execute_query(verify_query, (conversation_id, google_id))
-    if not result:
+    if not execute_query(query, (title, conversation_id, google_id)):
         raise ValueError("Conversation not found or access denied")
 
-    update_query = "UPDATE conversations SET title = %s WHERE id = %s"
-    execute_query(update_query, (title, conversation_id), fetch=False)
+# Google access tokens live about an hour; valid results are reused for ten minutes,
+# failures only briefly so a transient googleapis error is retried soon
+_google_token_cache = TTLCache(maxsize=10_000, ttl=600)
+_google_token_failure_cache = TTLCache(maxsize=10_000, ttl=5)
+_google_http_client = httpx.AsyncClient(timeout=5)
+
+async def close_google_http_client():
+    """Close the connections kept open for Google token verification"""
+    await _google_http_client.aclose()
 
-def verify_google_token(google_access_token: str) -> Optional[dict]:
+async def verify_google_token(google_access_token: str) -> Optional[dict]:
     """
     Verify Google OAuth token with Google's API
     In production, this validates the token and extracts user information
     """
-    try:
-        import requests
+    cache_key = hashlib.sha256(google_access_token.encode()).hexdigest()
+    cached = _google_token_cache.get(cache_key) or _google_token_failure_cache.get(cache_key)
+    if cached is not None:
+        return cached
 
+    try:
         # Verify token with Google's API
-        response = requests.get(
-            f"https://www.googleapis.com/oauth2/v2/userinfo?access_token={google_access_token}"
+        response = await _google_http_client.get(
+            "https://www.googleapis.com/oauth2/v2/userinfo",
+            params={"access_token": google_access_token}
         )
 
         if response.status_code == 200:
             user_data = response.json()
-            return {
+            result = {
                 "valid": True,
                 "user_id": user_data.get("id"),
                 "email": user_data.get("email"),
                 "name": user_data.get("name")
             }
+            _google_token_cache[cache_key] = result
+            return result
         else:
-            return {"valid": False, "error": "Invalid token"}
+            result = {"valid": False, "error": "Invalid token"}
 
     except Exception as e:
         print(f"Token verification error: {e}")
-        return {"valid": False, "error": str(e)}
+        result = {"valid": False, "error": str(e)}
+
+    _google_token_failure_cache[cache_key] = result
+    return result
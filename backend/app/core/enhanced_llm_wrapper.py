@@ -1,8 +1,11 @@
 import os
-import json
+import re
+import orjson
 import asyncio
-from typing import List, Dict, Any
+import hashlib
+from typing import List, Dict, Any, Tuple, AsyncIterator
 from openai import AsyncOpenAI
+from cachetools import TTLCache
 from app.core.config import settings
 from app.tools.search_tools import get_study_material, get_study_material_tool
 from app.tools.career_tools import get_career_insights, get_career_insights_tool
@@ -14,40 +17,78 @@ client = None
 if settings.OPENAI_API_KEY and settings.OPENAI_API_KEY != "your_openai_api_key_here":
     client = AsyncOpenAI(api_key=settings.OPENAI_API_KEY)
 
+# Exact-match cache of final replies keyed by (intent, message digest). Only turns whose
+# tools are read-only are stored, so a hit never skips a side effect such as marking
+# attendance. Accessed only from the event loop, without awaits in between, so no lock.
+_response_cache = TTLCache(maxsize=2000, ttl=3600)
+_CACHEABLE_TOOLS = {"get_study_material", "get_career_insights"}
+
+# Read-only tool (and the argument that takes the raw message) worth starting from the
+# detected intent alone, before the model has asked for it. The result is only used if
+# the model asks for exactly these arguments. Career insights are left out: the model
+# passes a field name, never the whole message. Side-effectful tools such as
+# mark_attendance and draft_email must never be listed here.
+_SPECULATIVE_TOOLS = {
+    "study": ("get_study_material", "query"),
+    "email": ("get_unread_emails", None)
+}
+
+def _response_cache_key(intent: str, message: str) -> tuple:
+    normalized = message.strip().lower()
+    return intent, hashlib.blake2b(normalized.encode(), digest_size=16).hexdigest()
+
+# Define intent categories with their associated tools
+_INTENT_KEYWORDS = {
+    "study": ["study", "learn", "explain", "what is", "help me understand", "exam", "topic", "concept", "algorithm", "syllabus", "material", "notes", "homework", "assignment"],
+    "career": ["career", "job", "salary", "work", "employment", "profession", "field", "market", "opportunity", "growth"],
+    "attendance": ["attendance", "present", "absent", "mark", "class", "course"],
+    "email": ["email", "gmail", "inbox", "draft", "send", "message", "unread", "check"]
+}
+
+# Single-word keywords are matched against the message's words with one set
+# intersection per intent; multi-word phrases keep a small word-bounded regex
+_INTENT_WORDS = {
+    intent: frozenset(keyword for keyword in keywords if " " not in keyword)
+    for intent, keywords in _INTENT_KEYWORDS.items()
+}
+_INTENT_PHRASES = {
+    intent: re.compile(r"\b(?:" + "|".join(re.escape(keyword) for keyword in keywords if " " in keyword) + r")\b")
+    for intent, keywords in _INTENT_KEYWORDS.items()
+    if any(" " in keyword for keyword in keywords)
+}
+_WORD_PATTERN = re.compile(r"[a-z]+")
+
 def detect_intent(message: str) -> str:
     """
     Detect the user's intent based on keywords in the message.
     """
     message_lower = message.lower()
-
-    # Define intent categories with their associated tools
-    intents = {
-        "study": ["study", "learn", "explain", "what is", "help me understand", "exam", "topic", "concept", "algorithm", "syllabus", "material", "notes", "homework", "assignment"],
-        "career": ["career", "job", "salary", "work", "employment", "profession", "field", "market", "opportunity", "growth"],
-        "attendance": ["attendance", "present", "absent", "mark", "class", "course"],
-        "email": ["email", "gmail", "inbox", "draft", "send", "message", "unread", "check"]
-    }
+    words = set(_WORD_PATTERN.findall(message_lower))
 
     # Check for each intent category
-    for intent, keywords in intents.items():
-        if any(keyword in message_lower for keyword in keywords):
+    for intent, keywords in _INTENT_WORDS.items():
+        if words & keywords:
+            return intent
+        phrases = _INTENT_PHRASES.get(intent)
+        if phrases and phrases.search(message_lower):
             return intent
 
     return "general"
 
+# Built once at import; prompts do not depend on the request
+_SYSTEM_PROMPTS = {
+    "study": "You are a helpful student mentor assistant. You have access to a tool that can search through study materials and documents. Use the get_study_material tool when students ask about academic topics, concepts, or need help with studying. Provide comprehensive answers based on the retrieved materials.",
+    "career": "You are a helpful career guidance assistant. You have access to a tool that can search for career insights and job market information. Use the get_career_insights tool when students ask about career prospects, job trends, salary information, or professional development. Provide helpful and realistic career advice.",
+    "attendance": "You are a helpful academic assistant. You have access to a tool that can mark student attendance in courses. Use the mark_attendance tool when students need to record their presence in class. Be efficient and provide clear confirmations.",
+    "email": "You are a helpful communication assistant. You have access to tools that can fetch unread emails and draft new messages. Use the get_unread_emails tool to check for important messages, and use the draft_email tool to compose new emails. Help students manage their inbox efficiently.",
+    "general": "You are a helpful student mentor assistant that provides guidance on various academic and personal topics. Be supportive, informative, and encouraging."
+}
+
 def create_system_prompt(intent: str) -> str:
     """
     Create an appropriate system prompt based on detected intent.
     """
-    prompts = {
-        "study": "You are a helpful student mentor assistant. You have access to a tool that can search through study materials and documents. Use the get_study_material tool when students ask about academic topics, concepts, or need help with studying. Provide comprehensive answers based on the retrieved materials.",
-        "career": "You are a helpful career guidance assistant. You have access to a tool that can search for career insights and job market information. Use the get_career_insights tool when students ask about career prospects, job trends, salary information, or professional development. Provide helpful and realistic career advice.",
-        "attendance": "You are a helpful academic assistant. You have access to a tool that can mark student attendance in courses. Use the mark_attendance tool when students need to record their presence in class. Be efficient and provide clear confirmations.",
-        "email": "You are a helpful communication assistant. You have access to tools that can fetch unread emails and draft new messages. Use the get_unread_emails tool to check for important messages, and use the draft_email tool to compose new emails. Help students manage their inbox efficiently.",
-        "general": "You are a helpful student mentor assistant that provides guidance on various academic and personal topics. Be supportive, informative, and encouraging."
-    }
-
-    return prompts.get(intent, prompts["general"])
+    return _SYSTEM_PROMPTS.get(intent, _SYSTEM_PROMPTS["general"])
 
 async def execute_tool(tool_name: str, tool_args: Dict[str, Any]) -> Dict[str, Any]:
     """
@@ -86,19 +127,21 @@ async def execute_tool(tool_name: str, tool_args: Dict[str, Any]) -> Dict[str, A
                 "message": f"Error executing {tool_name}: {str(e)}"
             }
 
-def get_all_tools() -> List[Dict[str, Any]]:
+_ALL_TOOLS = (
+    get_study_material_tool,
+    get_career_insights_tool,
+    mark_attendance_tool,
+    get_unread_emails_tool,
+    draft_email_tool
+)
+
+def get_all_tools() -> Tuple[Dict[str, Any], ...]:
     """
     Return all available tools for function calling.
     """
-    return [
-        get_study_material_tool,
-        get_career_insights_tool,
-        mark_attendance_tool,
-        get_unread_emails_tool,
-        draft_email_tool
-    ]
+    return _ALL_TOOLS
 
-async def get_llm_response_with_all_tools(message: str) -> str:
+def stream_llm_response_with_all_tools(message: str) -> AsyncIterator[str]:
     """
     Enhanced LLM response function with comprehensive tool integration.
 
@@ -107,73 +150,147 @@ async def get_llm_response_with_all_tools(message: str) -> str:
     2. Creates appropriate system prompt
     3. Provides all relevant tools to OpenAI
     4. Executes tool calls when requested by OpenAI
-    5. Formats responses appropriately
+    5. Streams the reply text as soon as OpenAI produces it
+
+    Configuration errors are raised here, before any streaming starts.
     """
     # Require API key for production - no mock responses
     if not client:
         raise ValueError("No LLM provider available. Please configure OpenAI API key in backend/.env file.")
 
+    return _stream_llm_response(message)
+
+async def _stream_llm_response(message: str) -> AsyncIterator[str]:
+    speculative_task = None
     try:
         # Detect user intent
         intent = detect_intent(message)
 
+        cache_key = _response_cache_key(intent, message)
+        cached_reply = _response_cache.get(cache_key)
+        if cached_reply is not None:
+            yield cached_reply
+            return
+        reply_parts = []
+        tool_results = []
+
+        # Run the tool the intent predicts during the first OpenAI round trip; if the
+        # model asks for it, its result is used instead of starting the call again
+        speculative_tool = _SPECULATIVE_TOOLS.get(intent)
+        if speculative_tool:
+            tool_name, arg_name = speculative_tool
+            speculative_args = {arg_name: message} if arg_name else {}
+            speculative_task = asyncio.create_task(execute_tool(tool_name, speculative_args))
+
         # Create appropriate system prompt
         system_prompt = create_system_prompt(intent)
 
         # Prepare tools for function calling
         tools = get_all_tools()
 
-        response = await client.chat.completions.create(
+        # The follow-up call repeats this prefix unchanged, so build it once
+        base_messages = [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": message}
+        ]
+
+        stream = await client.chat.completions.create(
             model="gpt-3.5-turbo",
-            messages=[
-                {
-                    "role": "system",
-                    "content": system_prompt
-                },
-                {"role": "user", "content": message}
-            ],
+            messages=base_messages,
             tools=tools,
             tool_choice="auto",
             max_tokens=1000,
-            temperature=0.3
+            temperature=0.3,
+            stream=True
         )
 
-        assistant_message = response.choices[0].message
+        # Forward content deltas directly; tool calls arrive in fragments keyed by index.
+        # Each call is dispatched as soon as the model moves on to the next one, so
+        # independent tools run while the rest of the turn is still being decoded.
+        tool_calls = {}
+        tool_tasks = {}
+
+        def dispatch(index):
+            nonlocal speculative_task
+            call = tool_calls[index]
+            tool_args = orjson.loads(call["arguments"] or "{}")
+            if speculative_task and call["name"] == speculative_tool[0] and tool_args == speculative_args:
+                tool_tasks[index], speculative_task = speculative_task, None
+                return
+            tool_tasks[index] = asyncio.create_task(execute_tool(call["name"], tool_args))
+
+        async for chunk in stream:
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta
+            if delta.content:
+                reply_parts.append(delta.content)
+                yield delta.content
+            for tool_call_delta in delta.tool_calls or []:
+                if tool_call_delta.index not in tool_calls:
+                    for index in tool_calls.keys() - tool_tasks.keys():
+                        dispatch(index)
+                call = tool_calls.setdefault(tool_call_delta.index, {"id": "", "name": "", "arguments": ""})
+                if tool_call_delta.id:
+                    call["id"] = tool_call_delta.id
+                if tool_call_delta.function:
+                    call["name"] += tool_call_delta.function.name or ""
+                    call["arguments"] += tool_call_delta.function.arguments or ""
 
         # Handle tool calls
-        if assistant_message.tool_calls:
-            for tool_call in assistant_message.tool_calls:
-                tool_name = tool_call.function.name
-                tool_args = json.loads(tool_call.function.arguments)
-
-                # Execute the tool
-                tool_result = await execute_tool(tool_name, tool_args)
-
-                # Create tool result message
-                tool_message = {
-                    "role": "tool",
-                    "tool_call_id": tool_call.id,
-                    "name": tool_name,
-                    "content": json.dumps(tool_result)
-                }
-
-                # Send tool result back to OpenAI for final response
-                final_response = await client.chat.completions.create(
-                    model="gpt-3.5-turbo",
-                    messages=[
-                        {"role": "system", "content": system_prompt},
-                        {"role": "user", "content": message},
-                        assistant_message,
-                        tool_message
-                    ],
-                    max_tokens=800,
-                    temperature=0.3
-                )
-
-                return final_response.choices[0].message.content
-
-        # If no tool was called, return the regular response
-        return assistant_message.content
+        if tool_calls:
+            for index in tool_calls.keys() - tool_tasks.keys():
+                dispatch(index)
+
+            # Wait for every tool at the turn boundary
+            indexes = sorted(tool_calls)
+            tool_results = await asyncio.gather(*(tool_tasks[index] for index in indexes))
+
+            assistant_message = {
+                "role": "assistant",
+                "content": None,
+                "tool_calls": [{
+                    "id": tool_calls[index]["id"],
+                    "type": "function",
+                    "function": {"name": tool_calls[index]["name"], "arguments": tool_calls[index]["arguments"]}
+                } for index in indexes]
+            }
+
+            # Create one tool result message per call
+            tool_messages = [{
+                "role": "tool",
+                "tool_call_id": tool_calls[index]["id"],
+                "name": tool_calls[index]["name"],
+                "content": orjson.dumps(tool_result).decode()
+            } for index, tool_result in zip(indexes, tool_results)]
+
+            # Send tool results back to OpenAI and stream the final response
+            final_stream = await client.chat.completions.create(
+                model="gpt-3.5-turbo",
+                messages=[*base_messages, assistant_message, *tool_messages],
+                max_tokens=800,
+                temperature=0.3,
+                stream=True
+            )
+
+            async for chunk in final_stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    reply_parts.append(chunk.choices[0].delta.content)
+                    yield chunk.choices[0].delta.content
+
+        if all(call["name"] in _CACHEABLE_TOOLS for call in tool_calls.values()) and \
+                all(result.get("success", True) for result in tool_results):
+            _response_cache[cache_key] = "".join(reply_parts)
 
     except Exception as e:
-        return f"Error: {str(e)}"
\ No newline at end of file
+        yield f"Error: {str(e)}"
+    finally:
+        # The model did not ask for the predicted tool
+        if speculative_task:
+            speculative_task.cancel()
+
+async def get_llm_response_with_all_tools(message: str) -> str:
+    """
+    Non-streaming variant of stream_llm_response_with_all_tools.
+    """
+    return "".join([part async for part in stream_llm_response_with_all_tools(message)])
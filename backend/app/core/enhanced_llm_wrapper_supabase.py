@@ -5,130 +5,231 @@ Supports dynamic LLM provider selection (OpenAI, Mistral)
 """
 
 import os
-import json
+import re
 import asyncio
 import logging
-from typing import List, Dict, Any, Optional
+from functools import lru_cache
+from typing import List, Dict, Any, Tuple, Optional, AsyncIterator, Awaitable, Callable, NamedTuple
 from app.core.config import settings
-from app.core.llm_factory import get_llm_provider
-from app.core.chat_memory import get_conversation_history, add_message, format_conversation_for_llm
+from app.core.llm_factory import get_llm_provider, synthesis_batcher
+from app.core.chat_memory import get_conversation_history, add_messages, format_conversation_for_llm, format_conversation_context
+from app.core import semantic_cache
 from app.tools.search_tools import get_study_material, get_study_material_tool
 from app.tools.career_tools import get_career_insights, get_career_insights_tool
 from app.tools.attendance_tools_supabase import mark_attendance, get_attendance_records, mark_attendance_tool, get_attendance_records_tool
-from app.tools.email_tools_supabase import get_unread_emails, draft_email, get_unread_emails_tool, draft_email_tool
+from app.tools.email_tools_supabase import get_unread_emails, get_gmail_connection, draft_email, get_unread_emails_tool, draft_email_tool
 
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-def detect_intent(message: str) -> str:
+# Define intent categories with their associated tools
+_INTENT_KEYWORDS = {
+    "study": ["study", "learn", "explain", "what is", "help me understand", "exam", "topic", "concept", "algorithm", "syllabus", "material", "notes", "homework", "assignment"],
+    "career": ["career", "job", "salary", "work", "employment", "profession", "field", "market", "opportunity", "growth"],
+    "attendance": ["attendance", "present", "absent", "mark", "class", "course"],
+    "email": ["email", "gmail", "inbox", "draft", "send", "message", "unread", "check"]
+}
+
+# Common career fields to look for
+_CAREER_FIELDS = [
+    "computer science", "software engineering", "data science", "machine learning",
+    "artificial intelligence", "web development", "mobile development", "devops",
+    "cybersecurity", "blockchain", "cloud computing", "it", "programming",
+    "engineering", "medicine", "law", "finance", "marketing", "design",
+    "business", "accounting", "teaching", "research"
+]
+
+# Look for course names or subjects
+_COURSES = [
+    "computer science", "mathematics", "physics", "chemistry", "biology",
+    "english", "history", "geography", "economics", "psychology",
+    "data structures", "algorithms", "database", "web development",
+    "machine learning", "artificial intelligence"
+]
+
+_COURSE_STOPWORDS = frozenset(["mark", "attendance", "present", "here", "class", "course"])
+
+# Every keyword and phrase of the three tables above, tagged with the slot it
+# fills, so one scan of the message answers all three questions
+_KEYWORD_TAGS: Dict[str, List[Tuple[str, str]]] = {}
+for _intent, _keywords in _INTENT_KEYWORDS.items():
+    for _keyword in _keywords:
+        _KEYWORD_TAGS.setdefault(_keyword, []).append(("intent", _intent))
+for _field in _CAREER_FIELDS:
+    _KEYWORD_TAGS.setdefault(_field, []).append(("field", _field))
+for _course in _COURSES:
+    _KEYWORD_TAGS.setdefault(_course, []).append(("course", _course))
+
+# Longest phrases first so "computer science" wins over any shorter keyword at the same position
+_KEYWORD_PATTERN = re.compile(
+    r"\b(?:" + "|".join(map(re.escape, sorted(_KEYWORD_TAGS, key=len, reverse=True))) + r")\b"
+)
+
+class IntentParse(NamedTuple):
+    """Intent and slot values extracted from one message"""
+    intent: str
+    field: str
+    course: str
+
+def classify(message: str, message_lower: Optional[str] = None) -> IntentParse:
     """
-    Detect the user's intent based on keywords in the message.
+    Detect the user's intent and extract the career field and course name
+    from a message in a single pass over its keywords.
+    Pass message_lower when the caller has already lowercased the message.
     """
-    message_lower = message.lower()
+    return _classify_lower(message.lower() if message_lower is None else message_lower)
+
+@lru_cache(maxsize=1024)
+def _classify_lower(message_lower: str) -> IntentParse:
+    intents = set()
+    field = None
+    course = None
+
+    for match in _KEYWORD_PATTERN.finditer(message_lower):
+        for slot, value in _KEYWORD_TAGS[match.group(0)]:
+            if slot == "intent":
+                intents.add(value)
+            elif slot == "field" and field is None:
+                field = value
+            elif slot == "course" and course is None:
+                course = value
+
+    # Intents are checked in declaration order, not by position in the message
+    intent = next((name for name in _INTENT_KEYWORDS if name in intents), "general")
+
+    if course is None:
+        # Try to extract words that might be course names
+        course = next(
+            (word.title() for word in message_lower.split() if len(word) > 3 and word not in _COURSE_STOPWORDS),
+            "General"
+        )
 
-    # Define intent categories with their associated tools
-    intents = {
-        "study": ["study", "learn", "explain", "what is", "help me understand", "exam", "topic", "concept", "algorithm", "syllabus", "material", "notes", "homework", "assignment"],
-        "career": ["career", "job", "salary", "work", "employment", "profession", "field", "market", "opportunity", "growth"],
-        "attendance": ["attendance", "present", "absent", "mark", "class", "course"],
-        "email": ["email", "gmail", "inbox", "draft", "send", "message", "unread", "check"]
-    }
+    # Default fallback
+    return IntentParse(intent, field or "technology", course)
 
-    # Check for each intent category
-    for intent, keywords in intents.items():
-        if any(keyword in message_lower for keyword in keywords):
-            return intent
+def detect_intent(message: str) -> str:
+    """
+    Detect the user's intent based on keywords in the message.
+    """
+    return classify(message).intent
 
-    return "general"
+# Built once at import; prompts do not depend on the request
+_SYSTEM_PROMPTS = {
+    "study": "You are a helpful student mentor assistant. You have access to a tool that can search through study materials and documents. Use the get_study_material tool when students ask about academic topics, concepts, or need help with studying. Provide comprehensive answers based on the retrieved materials.",
+    "career": "You are a helpful career guidance assistant. You have access to a tool that can search for career insights and job market information. Use the get_career_insights tool when students ask about career prospects, job trends, salary information, or professional development. Provide helpful and realistic career advice.",
+    "attendance": "You are a helpful academic assistant. You have access to tools that can mark student attendance and retrieve attendance records using Supabase. Use the mark_attendance tool when students need to record their presence in class. Be efficient and provide clear confirmations.",
+    "email": "You are a helpful communication assistant. You have access to tools that can fetch unread emails and draft new messages using Google OAuth tokens. Use the get_unread_emails tool to check for important messages, and use the draft_email tool to compose new emails. Help students manage their inbox efficiently.",
+    "general": "You are a helpful student mentor assistant that provides guidance on various academic and personal topics. Be supportive, informative, and encouraging."
+}
 
 def create_system_prompt(intent: str) -> str:
     """
     Create an appropriate system prompt based on detected intent.
     """
-    prompts = {
-        "study": "You are a helpful student mentor assistant. You have access to a tool that can search through study materials and documents. Use the get_study_material tool when students ask about academic topics, concepts, or need help with studying. Provide comprehensive answers based on the retrieved materials.",
-        "career": "You are a helpful career guidance assistant. You have access to a tool that can search for career insights and job market information. Use the get_career_insights tool when students ask about career prospects, job trends, salary information, or professional development. Provide helpful and realistic career advice.",
-        "attendance": "You are a helpful academic assistant. You have access to tools that can mark student attendance and retrieve attendance records using Supabase. Use the mark_attendance tool when students need to record their presence in class. Be efficient and provide clear confirmations.",
-        "email": "You are a helpful communication assistant. You have access to tools that can fetch unread emails and draft new messages using Google OAuth tokens. Use the get_unread_emails tool to check for important messages, and use the draft_email tool to compose new emails. Help students manage their inbox efficiently.",
-        "general": "You are a helpful student mentor assistant that provides guidance on various academic and personal topics. Be supportive, informative, and encouraging."
-    }
-
-    return prompts.get(intent, prompts["general"])
-
-async def execute_tool(tool_name: str, tool_args: Dict[str, Any], google_access_token: Optional[str] = None, user_id: Optional[int] = None, google_id: Optional[str] = None) -> Dict[str, Any]:
+    return _SYSTEM_PROMPTS.get(intent, _SYSTEM_PROMPTS["general"])
+
+class ToolContext(NamedTuple):
+    """Per-request credentials a tool handler may need, built once per request"""
+    google_access_token: Optional[str] = None
+    user_id: Optional[int] = None
+    google_id: Optional[str] = None
+    # Pending get_gmail_connection lookup started before the tool was dispatched
+    gmail_connection: Optional[Awaitable[Optional[Dict[str, Any]]]] = None
+    # Embedding of the study query already computed for the semantic cache
+    query_embedding: Optional[List[float]] = None
+
+async def _run_get_study_material(tool_args: Dict[str, Any], ctx: ToolContext) -> Dict[str, Any]:
+    logger.info(f"🔍 RAG SYSTEM ACTIVATED: Searching study materials for query: '{tool_args.get('query', '')}'")
+    return await get_study_material(tool_args.get("query", ""), ctx.google_id, ctx.query_embedding)
+
+async def _run_get_career_insights(tool_args: Dict[str, Any], ctx: ToolContext) -> Dict[str, Any]:
+    logger.info(f"💼 CAREER TOOL USED: Getting insights for field: '{tool_args.get('field', '')}'")
+    # The Tavily client is synchronous
+    return await asyncio.to_thread(get_career_insights, tool_args.get("field", ""))
+
+async def _run_mark_attendance(tool_args: Dict[str, Any], ctx: ToolContext) -> Dict[str, Any]:
+    logger.info(f"📝 ATTENDANCE TOOL USED: Marking attendance for course: '{tool_args.get('course_name', '')}'")
+    # Now requires user_id instead of student_name
+    if not ctx.user_id:
+        return {
+            "success": False,
+            "error": "User ID is required for attendance marking",
+            "message": "Please ensure you're logged in to mark attendance"
+        }
+    return await mark_attendance(
+        user_id=ctx.user_id,
+        course_name=tool_args.get("course_name", "")
+    )
+
+async def _run_get_attendance_records(tool_args: Dict[str, Any], ctx: ToolContext) -> Dict[str, Any]:
+    logger.info(f"📊 ATTENDANCE RECORDS TOOL USED: Retrieving records for course: '{tool_args.get('course_name')}'")
+    if not ctx.user_id:
+        return {
+            "success": False,
+            "error": "User ID is required for attendance records",
+            "message": "Please ensure you're logged in to view attendance"
+        }
+    return await get_attendance_records(
+        user_id=ctx.user_id,
+        course_name=tool_args.get("course_name")
+    )
+
+async def _run_get_unread_emails(tool_args: Dict[str, Any], ctx: ToolContext) -> Dict[str, Any]:
+    logger.info(f"📧 EMAIL TOOL USED: Fetching unread emails (max: {tool_args.get('max_results', 10)})")
+    # Now uses stored refresh token from database
+    if not ctx.google_id:
+        return {
+            "success": False,
+            "error": "User authentication required",
+            "message": "Please log in to access email functionality."
+        }
+    return await get_unread_emails(
+        user_id=ctx.google_id,
+        max_results=tool_args.get("max_results", 10),
+        connection_future=ctx.gmail_connection
+    )
+
+async def _run_draft_email(tool_args: Dict[str, Any], ctx: ToolContext) -> Dict[str, Any]:
+    logger.info(f"✉️ EMAIL DRAFT TOOL USED: Drafting email to: '{tool_args.get('to', '')}', subject: '{tool_args.get('subject', '')}'")
+    # Now requires google_access_token instead of user_id
+    if not ctx.google_access_token:
+        return {
+            "success": False,
+            "error": "Google access token is required",
+            "message": "To draft an email, I'll need your Google OAuth access token. Could you please ensure that I have the necessary permissions to access your Gmail account?"
+        }
+    return await draft_email(
+        google_access_token=ctx.google_access_token,
+        to=tool_args.get("to", ""),
+        subject=tool_args.get("subject", ""),
+        body=tool_args.get("body", "")
+    )
+
+_TOOL_HANDLERS: Dict[str, Callable[[Dict[str, Any], ToolContext], Awaitable[Dict[str, Any]]]] = {
+    "get_study_material": _run_get_study_material,
+    "get_career_insights": _run_get_career_insights,
+    "mark_attendance": _run_mark_attendance,
+    "get_attendance_records": _run_get_attendance_records,
+    "get_unread_emails": _run_get_unread_emails,
+    "draft_email": _run_draft_email
+}
+
+async def execute_tool(tool_name: str, tool_args: Dict[str, Any], ctx: ToolContext = ToolContext()) -> Dict[str, Any]:
     """
     Execute the appropriate tool function based on tool name.
     """
-    try:
-        if tool_name == "get_study_material":
-            logger.info(f"🔍 RAG SYSTEM ACTIVATED: Searching study materials for query: '{tool_args.get('query', '')}'")
-            return await get_study_material(tool_args.get("query", ""), google_id)
-        elif tool_name == "get_career_insights":
-            logger.info(f"💼 CAREER TOOL USED: Getting insights for field: '{tool_args.get('field', '')}'")
-            return await get_career_insights(tool_args.get("field", ""))
-        elif tool_name == "mark_attendance":
-            logger.info(f"📝 ATTENDANCE TOOL USED: Marking attendance for course: '{tool_args.get('course_name', '')}'")
-            # Now requires user_id instead of student_name
-            if not user_id:
-                return {
-                    "success": False,
-                    "error": "User ID is required for attendance marking",
-                    "message": "Please ensure you're logged in to mark attendance"
-                }
-            return await mark_attendance(
-                user_id=user_id,
-                course_name=tool_args.get("course_name", "")
-            )
-        elif tool_name == "get_attendance_records":
-            logger.info(f"📊 ATTENDANCE RECORDS TOOL USED: Retrieving records for course: '{tool_args.get('course_name')}'")
-            # New tool for retrieving attendance records
-            if not user_id:
-                return {
-                    "success": False,
-                    "error": "User ID is required for attendance records",
-                    "message": "Please ensure you're logged in to view attendance"
-                }
-            return await get_attendance_records(
-                user_id=user_id,
-                course_name=tool_args.get("course_name")
-            )
-        elif tool_name == "get_unread_emails":
-            logger.info(f"📧 EMAIL TOOL USED: Fetching unread emails (max: {tool_args.get('max_results', 10)})")
-            # Now uses stored refresh token from database
-            if not google_id:
-                return {
-                    "success": False,
-                    "error": "User authentication required",
-                    "message": "Please log in to access email functionality."
-                }
-            return await get_unread_emails(
-                user_id=google_id,
-                max_results=tool_args.get("max_results", 10)
-            )
-        elif tool_name == "draft_email":
-            logger.info(f"✉️ EMAIL DRAFT TOOL USED: Drafting email to: '{tool_args.get('to', '')}', subject: '{tool_args.get('subject', '')}'")
-            # Now requires google_access_token instead of user_id
-            if not google_access_token:
-                return {
-                    "success": False,
-                    "error": "Google access token is required",
-                    "message": "To draft an email, I'll need your Google OAuth access token. Could you please ensure that I have the necessary permissions to access your Gmail account?"
-                }
-            return await draft_email(
-                google_access_token=google_access_token,
-                to=tool_args.get("to", ""),
-                subject=tool_args.get("subject", ""),
-                body=tool_args.get("body", "")
-            )
-        else:
-            logger.warning(f"⚠️ UNKNOWN TOOL REQUESTED: {tool_name}")
-            return {
-                "success": False,
-                "error": f"Unknown tool: {tool_name}",
-                "message": f"Tool {tool_name} is not available"
-            }
+    handler = _TOOL_HANDLERS.get(tool_name)
+    if handler is None:
+        logger.warning(f"⚠️ UNKNOWN TOOL REQUESTED: {tool_name}")
+        return {
+            "success": False,
+            "error": f"Unknown tool: {tool_name}",
+            "message": f"Tool {tool_name} is not available"
+        }
 
+    try:
+        return await handler(tool_args, ctx)
     except Exception as e:
         logger.error(f"❌ TOOL EXECUTION ERROR for {tool_name}: {str(e)}")
         return {
@@ -137,60 +238,28 @@ async def execute_tool(tool_name: str, tool_args: Dict[str, Any], google_access_
             "message": f"Error executing {tool_name}: {str(e)}"
         }
 
+_EMAIL_ADDRESS_PATTERN = re.compile(r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b')
+_SUBJECT_PATTERN = re.compile(r'subject:?\s*([^\n]+)')
+
 def extract_career_field(message: str) -> str:
     """
     Extract career field from user message.
     """
-    message_lower = message.lower()
-
-    # Common career fields to look for
-    career_fields = [
-        "computer science", "software engineering", "data science", "machine learning",
-        "artificial intelligence", "web development", "mobile development", "devops",
-        "cybersecurity", "blockchain", "cloud computing", "it", "programming",
-        "engineering", "medicine", "law", "finance", "marketing", "design",
-        "business", "accounting", "teaching", "research"
-    ]
-
-    for field in career_fields:
-        if field in message_lower:
-            return field
-
-    # Default fallback
-    return "technology"
+    return classify(message).field
 
 def extract_course_name(message: str) -> str:
     """
     Extract course name from attendance-related messages.
     """
-    message_lower = message.lower()
-
-    # Look for course names or subjects
-    courses = [
-        "computer science", "mathematics", "physics", "chemistry", "biology",
-        "english", "history", "geography", "economics", "psychology",
-        "data structures", "algorithms", "database", "web development",
-        "machine learning", "artificial intelligence"
-    ]
-
-    for course in courses:
-        if course in message_lower:
-            return course
-
-    # Try to extract words that might be course names
-    words = message_lower.split()
-    for word in words:
-        if len(word) > 3 and word not in ["mark", "attendance", "present", "here", "class", "course"]:
-            return word.title()
+    return classify(message).course
 
-    return "General"
-
-def extract_email_details(message: str) -> Dict[str, Any]:
+def extract_email_details(message: str, message_lower: Optional[str] = None) -> Dict[str, Any]:
     """
     Extract email details from draft email messages.
     """
     # Simple extraction - in production this could use NLP
-    message_lower = message.lower()
+    if message_lower is None:
+        message_lower = message.lower()
 
     # Default values
     details = {
@@ -200,19 +269,157 @@ def extract_email_details(message: str) -> Dict[str, Any]:
     }
 
     # Try to extract recipient (look for email addresses or names)
-    import re
-    email_pattern = r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b'
-    emails = re.findall(email_pattern, message)
-    if emails:
-        details["to"] = emails[0]
+    email_match = _EMAIL_ADDRESS_PATTERN.search(message)
+    if email_match:
+        details["to"] = email_match.group(0)
 
     # Try to extract subject (look for "subject:" or similar)
-    subject_match = re.search(r'subject:?\s*([^\n]+)', message_lower)
+    subject_match = _SUBJECT_PATTERN.search(message_lower)
     if subject_match:
         details["subject"] = subject_match.group(1).strip()
 
     return details
 
+# Kept byte-for-byte identical across requests so it forms a cacheable prompt prefix
+_SYNTHESIS_INSTRUCTIONS = """Based on the following information from the user's study materials, please provide a comprehensive and well-structured answer to their question.
+
+Please synthesize this information into a clear, helpful answer. Focus on being accurate, comprehensive, and directly addressing the user's question. If the context doesn't fully answer the question, mention what additional information might be needed."""
+
+_STUDY_SOURCE_NOTE = "\n\n*This answer is based on information from your uploaded study materials. If you need more details or have additional questions, feel free to ask!*"
+
+# The source note is appended in code, so generation can stop if the model starts its own
+_SYNTHESIS_STOP = ["\n---", "\n\n*Source:", "\n\n*This answer is based on"]
+
+def _synthesis_options(context: str) -> Dict[str, Any]:
+    # A short context cannot justify a long answer; roughly one output token per three context characters
+    return {
+        "max_tokens": min(1500, max(256, len(context) // 3)),
+        "temperature": 0.2,
+        "stop": _SYNTHESIS_STOP
+    }
+
+def _synthesis_messages(context: str, original_message: str) -> List[Dict[str, Any]]:
+    # Stable instructions first and the question last, so providers that cache
+    # prompt prefixes can reuse the instructions (and the context, for repeat
+    # questions over the same materials)
+    return [
+        {"role": "system", "content": _SYNTHESIS_INSTRUCTIONS},
+        {"role": "system", "content": f"Study Materials Context:\n{context}"},
+        {"role": "user", "content": original_message}
+    ]
+
+# Questions that want reasoning rather than the passage itself still go to the LLM
+_OPEN_ENDED_PATTERN = re.compile(
+    r"\b(?:explain|compare|contrast|why|how|describe|discuss|difference|differences|elaborate|summari[sz]e|analy[sz]e|evaluate)\b"
+)
+
+def _direct_study_answer(context: str, original_message: str) -> Optional[str]:
+    """Return the retrieved context as the answer when synthesizing it would add little"""
+    if len(context) > settings.SYNTHESIS_SHORT_CIRCUIT_MAX_CHARS:
+        return None
+    if _OPEN_ENDED_PATTERN.search(original_message.lower()):
+        return None
+    return f"Here's what your study materials say:\n\n{context.strip()}{_STUDY_SOURCE_NOTE}"
+
+def _study_context_fallback(context: str) -> str:
+    response = f"Based on your study materials, here's what I found:\n\n{context}\n\n"
+    response += "If this doesn't fully answer your question, please provide more details or upload additional study materials."
+    return response
+
+async def _format_study_material(result: Dict[str, Any], original_message: str) -> str:
+    context = result.get("context", "")
+
+    # Check if no relevant materials were found
+    if "No relevant study materials found" in context:
+        return f"I searched through your uploaded study materials but couldn't find relevant information for '{original_message}'. Please try rephrasing your question or upload relevant documents that contain information about this topic."
+
+    # Short hits for lookup-style questions skip the synthesis call entirely
+    direct_answer = _direct_study_answer(context, original_message)
+    if direct_answer is not None:
+        return direct_answer
+
+    # Use LLM to synthesize an answer based on the retrieved context
+    try:
+        # Concurrent synthesis requests are coalesced into one provider call; the
+        # context is the user's own material, so only their requests share a batch
+        answer = await synthesis_batcher.submit(
+            messages=_synthesis_messages(context, original_message),
+            batch_key=result.get("user_id"),
+            tools=[],  # No tools needed for synthesis
+            tool_choice=None,
+            **_synthesis_options(context)
+        )
+
+        # Add a note about the source
+        answer += _STUDY_SOURCE_NOTE
+
+        return answer
+
+    except Exception as e:
+        logger.error(f"Error synthesizing answer with LLM: {str(e)}")
+        # Fallback to raw context if LLM synthesis fails
+        return _study_context_fallback(context)
+
+async def _format_career_insights(result: Dict[str, Any], original_message: str) -> str:
+    insights = result.get("insights", "")
+    if not insights:
+        field = extract_career_field(original_message)
+        return f"I couldn't find specific career insights for '{field}'. Please try a different career field or provide more details about your interests."
+
+    return f"Here are some career insights:\n\n{insights}"
+
+async def _format_mark_attendance(result: Dict[str, Any], original_message: str) -> str:
+    message = result.get("message", "")
+    if "success" in message.lower():
+        course_name = extract_course_name(original_message)
+        return f"✅ Attendance marked successfully for {course_name}!"
+    return f"There was an issue marking your attendance: {message}"
+
+async def _format_attendance_records(result: Dict[str, Any], original_message: str) -> str:
+    records = result.get("records", [])
+    if not records:
+        return "I couldn't find any attendance records for you. Make sure you've marked attendance for some classes first."
+
+    response = "Here are your attendance records:\n\n"
+    for record in records[:10]:  # Limit to 10 records
+        course = record.get("course_name", "Unknown")
+        date = record.get("marked_at", "Unknown")
+        response += f"• {course} - {date}\n"
+    if len(records) > 10:
+        response += f"\n(Showing 10 most recent out of {len(records)} records)"
+    return response
+
+async def _format_unread_emails(result: Dict[str, Any], original_message: str) -> str:
+    emails = result.get("emails", [])
+    if not emails:
+        return "You have no unread emails in your inbox."
+
+    response = f"You have {len(emails)} unread email(s):\n\n"
+    for i, email in enumerate(emails[:5], 1):  # Limit to 5 emails
+        subject = email.get("subject", "No Subject")
+        sender = email.get("from", "Unknown")
+        snippet = email.get("snippet", "")[:100]
+        response += f"{i}. **{subject}** from {sender}\n   {snippet}...\n\n"
+    if len(emails) > 5:
+        response += f"(Showing 5 most recent out of {len(emails)} emails)"
+    return response
+
+async def _format_draft_email(result: Dict[str, Any], original_message: str) -> str:
+    draft_id = result.get("draft_id")
+    draft_url = result.get("draft_url")
+    if draft_id:
+        return f"✅ Email draft created successfully!\n\nYou can review and send it here: {draft_url}"
+    return f"There was an issue creating your email draft: {result.get('message', 'Unknown error')}"
+
+_RESULT_FORMATTERS: Dict[str, Callable[[Dict[str, Any], str], Awaitable[str]]] = {
+    "get_study_material": _format_study_material,
+    "get_career_insights": _format_career_insights,
+    "mark_attendance": _format_mark_attendance,
+    "get_attendance_records": _format_attendance_records,
+    "get_unread_emails": _format_unread_emails,
+    "draft_email": _format_draft_email
+}
+
 async def process_tool_results(tool_results: List[Dict], intent: str, original_message: str, conversation_context: str = "") -> str:
     """
     Process tool results and generate appropriate response.
@@ -234,130 +441,150 @@ async def process_tool_results(tool_results: List[Dict], intent: str, original_m
         error_msg = result.get("error", "Unknown error")
         return f"I encountered an error while processing your request: {error_msg}"
 
-    # Process results based on tool type
-    if tool_name == "get_study_material":
-        context = result.get("context", "")
-        message = result.get("message", "")
-
-        # Check if no relevant materials were found
-        if "No relevant study materials found" in context:
-            return f"I searched through your uploaded study materials but couldn't find relevant information for '{original_message}'. Please try rephrasing your question or upload relevant documents that contain information about this topic."
-
-        # Check if there was an error
-        if not result.get("success", False):
-            return f"I encountered an error while searching study materials: {result.get('error', 'Unknown error')}"
-
-        # Use LLM to synthesize an answer based on the retrieved context
-        try:
-            llm_provider = get_llm_provider()
-
-            synthesis_prompt = f"""Based on the following information from the user's study materials, please provide a comprehensive and well-structured answer to their question: "{original_message}"
-
-Study Materials Context:
-{context}
-
-Please synthesize this information into a clear, helpful answer. Focus on being accurate, comprehensive, and directly addressing the user's question. If the context doesn't fully answer the question, mention what additional information might be needed."""
-
-            # Get LLM response using the synthesis prompt
-            synthesis_response = await llm_provider.create_completion(
-                messages=[{"role": "user", "content": synthesis_prompt}],
-                tools=[],  # No tools needed for synthesis
-                tool_choice=None,
-                max_tokens=1500,
-                temperature=0.3
-            )
-
-            # Extract the answer from the response
-            answer = synthesis_response['choices'][0]['message']['content']
-
-            # Add a note about the source
-            answer += "\n\n*This answer is based on information from your uploaded study materials. If you need more details or have additional questions, feel free to ask!*"
-
-            return answer
-
-        except Exception as e:
-            logger.error(f"Error synthesizing answer with LLM: {str(e)}")
-            # Fallback to raw context if LLM synthesis fails
-            response = f"Based on your study materials, here's what I found:\n\n{context}\n\n"
-            response += "If this doesn't fully answer your question, please provide more details or upload additional study materials."
-            return response
-
-    elif tool_name == "get_career_insights":
-        insights = result.get("insights", "")
-        if not insights:
-            field = extract_career_field(original_message)
-            return f"I couldn't find specific career insights for '{field}'. Please try a different career field or provide more details about your interests."
-
-        response = f"Here are some career insights:\n\n{insights}"
-
-    elif tool_name == "mark_attendance":
-        message = result.get("message", "")
-        if "success" in message.lower():
-            course_name = extract_course_name(original_message)
-            response = f"✅ Attendance marked successfully for {course_name}!"
-        else:
-            response = f"There was an issue marking your attendance: {message}"
-
-    elif tool_name == "get_attendance_records":
-        records = result.get("records", [])
-        if not records:
-            response = "I couldn't find any attendance records for you. Make sure you've marked attendance for some classes first."
-        else:
-            response = "Here are your attendance records:\n\n"
-            for record in records[:10]:  # Limit to 10 records
-                course = record.get("course_name", "Unknown")
-                date = record.get("marked_at", "Unknown")
-                response += f"• {course} - {date}\n"
-            if len(records) > 10:
-                response += f"\n(Showing 10 most recent out of {len(records)} records)"
-
-    elif tool_name == "get_unread_emails":
-        emails = result.get("emails", [])
-        if not emails:
-            response = "You have no unread emails in your inbox."
-        else:
-            response = f"You have {len(emails)} unread email(s):\n\n"
-            for i, email in enumerate(emails[:5], 1):  # Limit to 5 emails
-                subject = email.get("subject", "No Subject")
-                sender = email.get("from", "Unknown")
-                snippet = email.get("snippet", "")[:100]
-                response += f"{i}. **{subject}** from {sender}\n   {snippet}...\n\n"
-            if len(emails) > 5:
-                response += f"(Showing 5 most recent out of {len(emails)} emails)"
-
-    elif tool_name == "draft_email":
-        draft_id = result.get("draft_id")
-        draft_url = result.get("draft_url")
-        if draft_id:
-            response = f"✅ Email draft created successfully!\n\nYou can review and send it here: {draft_url}"
-        else:
-            response = f"There was an issue creating your email draft: {result.get('message', 'Unknown error')}"
-
-    else:
-        response = f"Tool executed successfully, but I don't know how to format the response for {tool_name}."
-
-    return response
-
-def get_all_tools() -> List[Dict[str, Any]]:
+    formatter = _RESULT_FORMATTERS.get(tool_name)
+    if formatter is None:
+        return f"Tool executed successfully, but I don't know how to format the response for {tool_name}."
+    return await formatter(result, original_message)
+
+async def stream_tool_results(
+    tool_results: List[Dict],
+    intent: str,
+    original_message: str,
+    conversation_context: str = "",
+    stream_synthesis: bool = True
+) -> AsyncIterator[str]:
+    """
+    Streaming variant of process_tool_results.
+    Study-material answers are streamed from the LLM as they are generated;
+    every other result is yielded in one piece.
+    """
+    if stream_synthesis and tool_results and tool_results[0]["tool_name"] == "get_study_material":
+        result = tool_results[0]["tool_result"]
+        context = result.get("context", "") if isinstance(result, dict) else ""
+        if (
+            context
+            and result.get("success", False)
+            and "No relevant study materials found" not in context
+            and _direct_study_answer(context, original_message) is None
+        ):
+            streamed = False
+            try:
+                async for part in get_llm_provider().stream_completion(
+                    messages=_synthesis_messages(context, original_message),
+                    **_synthesis_options(context)
+                ):
+                    streamed = True
+                    yield part
+            except Exception as e:
+                logger.error(f"Error synthesizing answer with LLM: {str(e)}")
+                if streamed:
+                    raise
+                # Fallback to raw context if LLM synthesis fails
+                yield _study_context_fallback(context)
+                return
+            yield _STUDY_SOURCE_NOTE
+            return
+
+    yield await process_tool_results(tool_results, intent, original_message, conversation_context)
+
+_MARK_ATTENDANCE_WORDS = ("mark", "present", "here", "attending")
+_DRAFT_EMAIL_WORDS = ("draft", "write", "compose", "send")
+
+def select_forced_tool(parse: IntentParse, message: str, message_lower: Optional[str] = None) -> Tuple[str, Dict[str, Any]]:
+    """
+    Pick the tool and arguments forced for an intent.
+    """
+    intent = parse.intent
+    if message_lower is None:
+        message_lower = message.lower()
+
+    if intent == "study":
+        # Always use RAG for study queries
+        logger.info("📚 STUDY INTENT: Forcing get_study_material tool")
+        return "get_study_material", {"query": message}
+
+    if intent == "career":
+        # Extract field from message for career insights
+        field = parse.field
+        logger.info(f"💼 CAREER INTENT: Forcing get_career_insights tool for field: {field}")
+        return "get_career_insights", {"field": field}
+
+    if intent == "attendance":
+        # Determine if user wants to mark attendance or get records
+        if any(word in message_lower for word in _MARK_ATTENDANCE_WORDS):
+            course_name = parse.course
+            logger.info(f"📝 ATTENDANCE INTENT: Forcing mark_attendance tool for course: {course_name}")
+            return "mark_attendance", {"course_name": course_name}
+        # Default to getting attendance records
+        course_name = parse.course
+        logger.info(f"📊 ATTENDANCE INTENT: Forcing get_attendance_records tool for course: {course_name}")
+        return "get_attendance_records", {"course_name": course_name}
+
+    if intent == "email":
+        # Determine if user wants to check emails or draft
+        if any(word in message_lower for word in _DRAFT_EMAIL_WORDS):
+            logger.info(f"✉️ EMAIL INTENT: Forcing draft_email tool")
+            return "draft_email", extract_email_details(message, message_lower)
+        # Default to checking unread emails
+        logger.info(f"📧 EMAIL INTENT: Forcing get_unread_emails tool")
+        return "get_unread_emails", {"max_results": 10}
+
+    # For general queries, try RAG first as fallback
+    logger.info("🔍 GENERAL INTENT: Trying get_study_material tool as fallback")
+    return "get_study_material", {"query": message}
+
+def _plan_tool_call(message: str) -> Tuple[IntentParse, str, Dict[str, Any]]:
+    # Lowercased once and shared by intent detection and argument extraction
+    message_lower = message.lower()
+    parse = classify(message, message_lower)
+    logger.info(f"🎯 INTENT DETECTED: '{parse.intent}' for message: '{message[:50]}...'")
+    tool_name, tool_args = select_forced_tool(parse, message, message_lower)
+    return parse, tool_name, tool_args
+
+# Messages longer than this are scanned in a worker thread so a pasted
+# document does not stall every other chat on the event loop
+_LONG_MESSAGE_CHARS = 4000
+
+async def _scan_message(message: str, scan: Callable[..., Any], *args) -> Any:
+    """Run a keyword/regex scan of the message, off the event loop when the message is long"""
+    if len(message) > _LONG_MESSAGE_CHARS:
+        return await asyncio.to_thread(scan, *args)
+    return scan(*args)
+
+_ALL_TOOLS = (
+    get_study_material_tool,
+    get_career_insights_tool,
+    mark_attendance_tool,
+    get_attendance_records_tool,  # Added new tool
+    get_unread_emails_tool,
+    draft_email_tool
+)
+
+def get_all_tools() -> Tuple[Dict[str, Any], ...]:
     """
     Return all available tools for function calling.
     """
-    return [
-        get_study_material_tool,
-        get_career_insights_tool,
-        mark_attendance_tool,
-        get_attendance_records_tool,  # Added new tool
-        get_unread_emails_tool,
-        draft_email_tool
-    ]
+    return _ALL_TOOLS
 
-async def get_llm_response_with_supabase(
+# Chat memory writes still in flight; holding a reference keeps them from being
+# garbage collected before they finish
+_background_writes = set()
+
+def _store_in_background(user_id: int, messages: List[Tuple[str, str]]):
+    """Write messages to chat memory in a worker thread without awaiting it"""
+    # add_messages logs and swallows its own errors, so a failed write never fails the reply
+    task = asyncio.create_task(asyncio.to_thread(add_messages, user_id, messages))
+    _background_writes.add(task)
+    task.add_done_callback(_background_writes.discard)
+
+async def stream_llm_response_with_supabase(
     message: str,
     google_access_token: Optional[str] = None,
     user_id: Optional[int] = None,
     google_id: Optional[str] = None,
-    conversation_id: Optional[str] = None
-) -> str:
+    conversation_id: Optional[str] = None,
+    stream_synthesis: bool = True
+) -> AsyncIterator[str]:
     """
     Enhanced LLM response function with Supabase integration and chat memory.
     Supports dynamic LLM provider selection (OpenAI, Mistral).
@@ -368,165 +595,189 @@ async def get_llm_response_with_supabase(
     3. Creates appropriate system prompt with context
     4. Provides all relevant tools to the selected LLM
     5. Executes tool calls when requested by the LLM
-    6. Stores conversation in Supabase
-    7. Returns formatted responses
+    6. Streams the formatted response (study answers token by token)
+    7. Stores conversation in Supabase once the response is complete
     """
+    gmail_connection = None
     try:
         # Get the configured LLM provider
         llm_provider = get_llm_provider()
 
-        # Store user message in chat memory
-        if user_id:
-            add_message(user_id, 'user', message)
+        # Detect user intent and pick the tool to force
+        parse, tool_name, tool_args = await _scan_message(message, _plan_tool_call, message)
+        intent = parse.intent
+
+        # Start the stored Gmail token lookup now so its round trip overlaps the
+        # history load below instead of following it
+        if tool_name == "get_unread_emails" and google_id:
+            gmail_connection = asyncio.create_task(get_gmail_connection(google_id))
+        tool_ctx = ToolContext(google_access_token, user_id, google_id, gmail_connection)
 
         # Get conversation history for context
         conversation_context = ""
         if conversation_id:
             # Use conversation-specific history if available
             try:
-                from app.core.db_client import get_messages_by_conversation
-                messages = get_messages_by_conversation(conversation_id)
-                # Format messages for LLM
-                if messages:
-                    conversation_context = "\n".join([
-                        f"{'User' if msg['role'] == 'user' else 'Assistant'}: {msg['content']}"
-                        for msg in messages[-10:]  # Last 10 messages
-                    ])
+                # Last 10 messages, formatted incrementally from cache
+                conversation_context = await asyncio.to_thread(format_conversation_context, conversation_id, 10)
             except:
                 pass  # Fall back to user-based history if conversation-specific fails
 
         if not conversation_context and user_id:
             # Fallback to user-based history
-            conversation_context = format_conversation_for_llm(user_id, limit=10)
-
-        # Detect user intent
-        intent = detect_intent(message)
-        logger.info(f"🎯 INTENT DETECTED: '{intent}' for message: '{message[:50]}...'")
+            conversation_context = await asyncio.to_thread(format_conversation_for_llm, user_id, 10)
+
+        # Answer paraphrases of recent read-only questions from the semantic cache
+        cache_key = semantic_cache.cache_key(intent, google_id)
+        cache_embedding = await semantic_cache.embed(message) if cache_key else None
+        if cache_embedding is not None:
+            cached_reply = semantic_cache.lookup(cache_key, cache_embedding)
+            if cached_reply is not None:
+                logger.info("♻️ SEMANTIC CACHE HIT: Reusing reply for a similar message")
+                yield cached_reply
+                if user_id:
+                    _store_in_background(user_id, [('user', message), ('ai', cached_reply)])
+                return
+            # Same model as the RAG search, so it doesn't need to embed the message again
+            if tool_args.get("query") == message:
+                tool_ctx = tool_ctx._replace(query_embedding=cache_embedding.tolist())
 
         # Force tool execution based on intent - never use direct LLM response
-        tool_results = []
-
-        if intent == "study":
-            # Always use RAG for study queries
-            logger.info("📚 STUDY INTENT: Forcing get_study_material tool")
-            tool_result = await execute_tool(
-                "get_study_material",
-                {"query": message},
-                google_access_token=google_access_token,
-                user_id=user_id,
-                google_id=google_id
-            )
-            tool_results.append({
-                "tool_name": "get_study_material",
-                "tool_result": tool_result
-            })
-
-        elif intent == "career":
-            # Extract field from message for career insights
-            field = extract_career_field(message)
-            logger.info(f"💼 CAREER INTENT: Forcing get_career_insights tool for field: {field}")
-            tool_result = await execute_tool(
-                "get_career_insights",
-                {"field": field},
-                google_access_token=google_access_token,
-                user_id=user_id,
-                google_id=google_id
-            )
-            tool_results.append({
-                "tool_name": "get_career_insights",
-                "tool_result": tool_result
-            })
-
-        elif intent == "attendance":
-            # Determine if user wants to mark attendance or get records
-            if any(word in message.lower() for word in ["mark", "present", "here", "attending"]):
-                # Extract course name from message
-                course_name = extract_course_name(message)
-                logger.info(f"📝 ATTENDANCE INTENT: Forcing mark_attendance tool for course: {course_name}")
-                tool_result = await execute_tool(
-                    "mark_attendance",
-                    {"course_name": course_name},
-                    google_access_token=google_access_token,
-                    user_id=user_id,
-                    google_id=google_id
-                )
-            else:
-                # Default to getting attendance records
-                course_name = extract_course_name(message) or ""
-                logger.info(f"📊 ATTENDANCE INTENT: Forcing get_attendance_records tool for course: {course_name}")
-                tool_result = await execute_tool(
-                    "get_attendance_records",
-                    {"course_name": course_name},
-                    google_access_token=google_access_token,
-                    user_id=user_id,
-                    google_id=google_id
-                )
-            tool_results.append({
-                "tool_name": "mark_attendance" if "mark" in message.lower() else "get_attendance_records",
-                "tool_result": tool_result
-            })
-
-        elif intent == "email":
-            # Determine if user wants to check emails or draft
-            if any(word in message.lower() for word in ["draft", "write", "compose", "send"]):
-                # Extract email details from message
-                email_details = extract_email_details(message)
-                logger.info(f"✉️ EMAIL INTENT: Forcing draft_email tool")
-                tool_result = await execute_tool(
-                    "draft_email",
-                    email_details,
-                    google_access_token=google_access_token,
-                    user_id=user_id,
-                    google_id=google_id
-                )
-            else:
-                # Default to checking unread emails
-                logger.info(f"📧 EMAIL INTENT: Forcing get_unread_emails tool")
-                tool_result = await execute_tool(
-                    "get_unread_emails",
-                    {"max_results": 10},
-                    google_access_token=google_access_token,
-                    user_id=user_id,
-                    google_id=google_id
-                )
-            tool_results.append({
-                "tool_name": "draft_email" if any(word in message.lower() for word in ["draft", "write", "compose", "send"]) else "get_unread_emails",
-                "tool_result": tool_result
-            })
-
-        else:  # general intent
-            # For general queries, try RAG first as fallback
-            logger.info("🔍 GENERAL INTENT: Trying get_study_material tool as fallback")
-            tool_result = await execute_tool(
-                "get_study_material",
-                {"query": message},
-                google_access_token=google_access_token,
-                user_id=user_id,
-                google_id=google_id
-            )
-            tool_results.append({
-                "tool_name": "get_study_material",
-                "tool_result": tool_result
-            })
+        general_answer_task = None
+
+        if intent == "general":
+            # Ask the model directly while RAG runs; the direct answer is only used
+            # if the study materials have nothing relevant
+            general_answer_task = asyncio.create_task(llm_provider.create_completion(
+                messages=[
+                    {"role": "system", "content": create_system_prompt("general")},
+                    {"role": "user", "content": message}
+                ],
+                tools=[],
+                tool_choice=None,
+                max_tokens=800,
+                temperature=0.3
+            ))
 
-        # Process tool results and generate response
-        assistant_reply = await process_tool_results(tool_results, intent, message, conversation_context)
+        tool_result = await execute_tool(tool_name, tool_args, tool_ctx)
+        tool_results = [{
+            "tool_name": tool_name,
+            "tool_result": tool_result
+        }]
 
-        # Store AI response in chat memory
+        # Process tool results and generate response
+        assistant_reply = None
+        if general_answer_task:
+            rag_result = tool_results[0]["tool_result"]
+            if rag_result.get("success", False) and "No relevant study materials found" not in rag_result.get("context", ""):
+                general_answer_task.cancel()
+            else:
+                try:
+                    general_answer = await general_answer_task
+                    assistant_reply = general_answer['choices'][0]['message']['content']
+                except Exception as e:
+                    logger.error(f"Error getting direct answer for general query: {str(e)}")
+        if assistant_reply is not None:
+            yield assistant_reply
+        else:
+            reply_parts = []
+            async for part in stream_tool_results(tool_results, intent, message, conversation_context, stream_synthesis):
+                reply_parts.append(part)
+                yield part
+            assistant_reply = "".join(reply_parts)
+
+        # Only replies built from successful tool calls that found something are worth reusing
+        if cache_embedding is not None and all(
+            result["tool_result"].get("success", True)
+            and "No relevant study materials found" not in result["tool_result"].get("context", "")
+            for result in tool_results
+        ):
+            semantic_cache.store(cache_key, cache_embedding, assistant_reply)
+
+        # Store the user message and AI response in chat memory in one write,
+        # without holding up the response
         if user_id:
-            add_message(user_id, 'ai', assistant_reply)
-
-        return assistant_reply
+            _store_in_background(user_id, [('user', message), ('ai', assistant_reply)])
 
     except Exception as e:
         error_message = f"Error: {str(e)}"
         logger.error(f"💥 LLM RESPONSE ERROR: {str(e)}")
 
-        # Store error in chat memory if user_id is available
+        # Store the user message and error in chat memory if user_id is available
         if user_id:
-            add_message(user_id, 'ai', error_message)
+            _store_in_background(user_id, [('user', message), ('ai', error_message)])
+
+        yield error_message
+    finally:
+        # An error or a closed stream can end the turn before the
+        # email tool awaited the prefetched Gmail lookup
+        if gmail_connection is not None and not gmail_connection.done():
+            gmail_connection.cancel()
+
+# Replies still being generated, keyed by _inflight_key; identical requests that
+# arrive meanwhile await the same task instead of running the pipeline again.
+# The task is detached from the request that started it, so a caller that
+# disconnects never cancels the answer other callers are waiting for. Entries
+# are removed as soon as the reply is ready, so the dict only ever holds the
+# requests currently in progress.
+_inflight: Dict[Tuple[str, Optional[str], str], asyncio.Task] = {}
+
+def _inflight_key(message: str, google_id: Optional[str]) -> Optional[Tuple[str, Optional[str], str]]:
+    """Return the coalescing key for a request, or None if it must run on its own"""
+    message_lower = message.lower()
+    intent = classify(message, message_lower).intent
+    normalized = " ".join(message_lower.split())
+    # Study answers come from the user's own documents; career insights are
+    # shared. Attendance and email act on the user's account and never coalesce.
+    if intent == "study" and google_id:
+        return intent, google_id, normalized
+    if intent == "career":
+        return intent, None, normalized
+    return None
 
-        return error_message
+async def get_llm_response_with_supabase(
+    message: str,
+    google_access_token: Optional[str] = None,
+    user_id: Optional[int] = None,
+    google_id: Optional[str] = None,
+    conversation_id: Optional[str] = None
+) -> str:
+    """
+    Non-streaming variant of stream_llm_response_with_supabase.
+    Study-material synthesis goes through the shared batcher instead of streaming.
+    Identical study or career questions already in flight share one answer.
+    """
+    key = await _scan_message(message, _inflight_key, message, google_id)
+
+    async def generate() -> str:
+        return "".join([
+            part async for part in stream_llm_response_with_supabase(
+                message,
+                google_access_token=google_access_token,
+                user_id=user_id,
+                google_id=google_id,
+                conversation_id=conversation_id,
+                stream_synthesis=False
+            )
+        ])
+
+    if not key:
+        return await generate()
+
+    pending = _inflight.get(key)
+    if pending is not None:
+        logger.info("🔗 SINGLEFLIGHT: Waiting for an identical request already in progress")
+        reply = await asyncio.shield(pending)
+        # The first request only records its own turn
+        if user_id:
+            _store_in_background(user_id, [('user', message), ('ai', reply)])
+        return reply
+
+    task = asyncio.create_task(generate())
+    _inflight[key] = task
+    task.add_done_callback(lambda _: _inflight.pop(key, None))
+    # Shielded so cancelling this request leaves the shared task running
+    return await asyncio.shield(task)
 
 # Backward compatibility function
 async def get_llm_response_with_all_tools(message: str) -> str:
@@ -3,7 +3,9 @@ Dynamic LLM Factory
 Supports multiple LLM providers (OpenAI, GLM-4.5, Gemini, Mistral) based on configuration
 """
 
-from typing import Optional, List, Dict, Any
+import asyncio
+import orjson
+from typing import Optional, List, Dict, Any, Tuple, Set, AsyncIterator
 from abc import ABC, abstractmethod
 from app.core.config import settings
 
@@ -15,11 +17,20 @@ class LLMProvider(ABC):
         """Create a completion with the LLM"""
         pass
 
+    async def stream_completion(self, messages: List[Dict[str, Any]], **kwargs) -> AsyncIterator[str]:
+        """Stream the completion text; providers without streaming yield it in one piece"""
+        response = await self.create_completion(messages, **kwargs)
+        yield response['choices'][0]['message']['content'] or ""
+
     @abstractmethod
     def get_model_name(self) -> str:
         """Get the model name"""
         pass
 
+    async def aclose(self):
+        """Release pooled connections; providers without their own HTTP client have nothing to close"""
+        pass
+
 class OpenAIProvider(LLMProvider):
     """OpenAI LLM Provider"""
 
@@ -45,7 +56,8 @@ class OpenAIProvider(LLMProvider):
             tools=tools if tools else None,
             tool_choice=tool_choice if tools else None,
             max_tokens=kwargs.get('max_tokens', 1000),
-            temperature=kwargs.get('temperature', 0.3)
+            temperature=kwargs.get('temperature', 0.3),
+            stop=kwargs.get('stop')
         )
 
         return {
@@ -57,6 +69,22 @@ class OpenAIProvider(LLMProvider):
             }]
         }
 
+    async def stream_completion(self, messages: List[Dict[str, Any]], **kwargs) -> AsyncIterator[str]:
+        if not self.available or not self.client:
+            raise ValueError("OpenAI client not available")
+
+        stream = await self.client.chat.completions.create(
+            model=settings.OPENAI_MODEL,
+            messages=messages,
+            max_tokens=kwargs.get('max_tokens', 1000),
+            temperature=kwargs.get('temperature', 0.3),
+            stop=kwargs.get('stop'),
+            stream=True
+        )
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
     def get_model_name(self) -> str:
         return settings.OPENAI_MODEL
 
@@ -65,17 +93,21 @@ class GLMProvider(LLMProvider):
 
     def __init__(self):
         try:
-            import requests
-            self.requests = requests
+            import httpx
+            # Shared async client so GLM calls reuse connections and never block the event loop
+            self.http = httpx.AsyncClient(
+                timeout=60.0,
+                limits=httpx.Limits(max_keepalive_connections=32, max_connections=64)
+            )
             self.api_key = settings.GLM_API_KEY
             self.base_url = "https://api.z.ai/api/paas/v4/chat/completions"
             self.available = bool(self.api_key)
         except ImportError:
-            self.requests = None
+            self.http = None
             self.available = False
 
     async def create_completion(self, messages: List[Dict[str, Any]], **kwargs) -> Dict[str, Any]:
-        if not self.available or not self.requests:
+        if not self.available or not self.http:
             raise ValueError("GLM client not available")
 
         # Prepare the payload
@@ -86,6 +118,9 @@ class GLMProvider(LLMProvider):
             "max_tokens": kwargs.get('max_tokens', 1000)
         }
 
+        if kwargs.get('stop'):
+            payload["stop"] = kwargs['stop']
+
         # Add tools if provided
         tools = kwargs.get('tools', [])
         if tools:
@@ -98,7 +133,7 @@ class GLMProvider(LLMProvider):
         }
 
         # Make the API call
-        response = self.requests.post(self.base_url, json=payload, headers=headers)
+        response = await self.http.post(self.base_url, json=payload, headers=headers)
         response.raise_for_status()
 
         data = response.json()
@@ -116,6 +151,10 @@ class GLMProvider(LLMProvider):
     def get_model_name(self) -> str:
         return settings.GLM_MODEL
 
+    async def aclose(self):
+        if self.http:
+            await self.http.aclose()
+
 class GeminiProvider(LLMProvider):
     """Google Gemini LLM Provider"""
 
@@ -138,17 +177,20 @@ class GeminiProvider(LLMProvider):
             raise ValueError("Gemini client not available")
 
         # Convert OpenAI format messages to Gemini format
+        system_parts = []
         contents = []
         for msg in messages:
-            if msg['role'] == 'system':
-                # Gemini doesn't have system role, add as user message
-                contents.append(f"System: {msg['content']}")
-            elif msg['role'] == 'user':
+            role = msg['role']
+            if role == 'system':
+                system_parts.append(msg['content'])
+            elif role == 'user':
                 contents.append(msg['content'])
-            elif msg['role'] == 'assistant':
-                # For now, we'll skip assistant messages in the content
-                # In a full implementation, you'd handle conversation history properly
-                pass
+            # For now, we'll skip assistant messages in the content
+            # In a full implementation, you'd handle conversation history properly
+
+        if system_parts:
+            # Gemini doesn't have system role; all system prompts go first as one user message
+            contents.insert(0, "System: " + "\n".join(system_parts))
 
         # Convert tools to Gemini format
         tools = kwargs.get('tools', [])
@@ -169,6 +211,8 @@ class GeminiProvider(LLMProvider):
             "temperature": kwargs.get('temperature', 0.3),
             "max_output_tokens": kwargs.get('max_tokens', 1000)
         }
+        if kwargs.get('stop'):
+            config_kwargs["stop_sequences"] = kwargs['stop']
         if gemini_tools:
             config_kwargs["tools"] = gemini_tools
 
@@ -196,7 +240,7 @@ class GeminiProvider(LLMProvider):
                     'id': f'call_{len(tool_calls)}',
                     'function': {
                         'name': func_call.name,
-                        'arguments': str(func_call.args) if func_call.args else '{}'
+                        'arguments': orjson.dumps(dict(func_call.args)).decode() if func_call.args else '{}'
                     }
                 })
             elif hasattr(part, 'text') and part.text:
@@ -254,7 +298,8 @@ class MistralProvider(LLMProvider):
             tools=tools if tools else None,
             tool_choice=tool_choice if tools else None,
             max_tokens=kwargs.get('max_tokens', 1000),
-            temperature=kwargs.get('temperature', 0.3)
+            temperature=kwargs.get('temperature', 0.3),
+            stop=kwargs.get('stop')
         )
 
         # Convert Mistral response to OpenAI-like format
@@ -305,6 +350,7 @@ class OpenRouterProvider(LLMProvider):
             tool_choice=tool_choice if tools else None,
             max_tokens=kwargs.get('max_tokens', 1000),
             temperature=kwargs.get('temperature', 0.3),
+            stop=kwargs.get('stop'),
             extra_headers=extra_headers
         )
 
@@ -317,6 +363,26 @@ class OpenRouterProvider(LLMProvider):
             }]
         }
 
+    async def stream_completion(self, messages: List[Dict[str, Any]], **kwargs) -> AsyncIterator[str]:
+        if not self.available or not self.client:
+            raise ValueError("OpenRouter client not available")
+
+        stream = await self.client.chat.completions.create(
+            model=settings.OPENROUTER_MODEL,
+            messages=messages,
+            max_tokens=kwargs.get('max_tokens', 1000),
+            temperature=kwargs.get('temperature', 0.3),
+            stop=kwargs.get('stop'),
+            extra_headers={
+                "HTTP-Referer": "https://studyrobo.com",
+                "X-Title": "StudyRobo",
+            },
+            stream=True
+        )
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
     def get_model_name(self) -> str:
         return settings.OPENROUTER_MODEL
 
@@ -324,30 +390,146 @@ class LLMFactory:
     """Factory for creating LLM providers"""
 
     def __init__(self):
-        self.providers = {
-            'openai': OpenAIProvider(),
-            'glm': GLMProvider(),
-            'gemini': GeminiProvider(),
-            'mistral': MistralProvider(),
-            'openrouter': OpenRouterProvider()
+        # Providers are built on first use, so only the configured provider's SDK
+        # is imported and only its HTTP client is created
+        self._provider_classes = {
+            'openai': OpenAIProvider,
+            'glm': GLMProvider,
+            'gemini': GeminiProvider,
+            'mistral': MistralProvider,
+            'openrouter': OpenRouterProvider
         }
+        self.providers: Dict[str, LLMProvider] = {}
 
     def get_provider(self, provider_name: Optional[str] = None) -> LLMProvider:
         """Get LLM provider by name"""
         provider_name = provider_name or settings.LLM_PROVIDER
 
-        if provider_name not in self.providers:
+        if provider_name not in self._provider_classes:
             raise ValueError(f"Unknown LLM provider: {provider_name}")
 
-        provider = self.providers[provider_name]
+        provider = self.providers.get(provider_name)
+        if provider is None:
+            provider = self.providers[provider_name] = self._provider_classes[provider_name]()
         if not provider.available:
             raise ValueError(f"LLM provider {provider_name} is not available (missing dependencies or API key)")
 
         return provider
 
+    async def aclose(self):
+        """Close the HTTP clients held by every provider created so far"""
+        await asyncio.gather(*(provider.aclose() for provider in self.providers.values()))
+
 # Global LLM factory instance
 llm_factory = LLMFactory()
 
 def get_llm_provider(provider_name: Optional[str] = None) -> LLMProvider:
     """Get LLM provider (convenience function)"""
     return llm_factory.get_provider(provider_name)
+
+_BATCH_SYSTEM_PROMPT = """You will receive several independent chat requests as a JSON array. Each request has an "id" and a list of "messages" in chat format.
+Answer every request on its own, exactly as if it were the only conversation, following any instructions in its messages.
+Reply with only a JSON object of the form {"answers": [{"id": <id>, "answer": "<answer text>"}]} containing one entry per request."""
+
+class BatchingLLMClient:
+    """
+    Coalesces completions submitted within a short window into one provider call.
+
+    Pending requests are row-marshaled into a single prompt and the model returns
+    one answer per request id. Requests are only batched with others sharing the
+    same batch key, so callers holding private context (e.g. one user's study
+    materials) never share a prompt with anyone else. A batch is closed early once
+    its requests' combined max_tokens would exceed max_batch_tokens, so the batched
+    reply always has room for every answer. A lone request, or any request the
+    batched reply leaves unanswered, is sent on its own.
+    """
+
+    def __init__(self, max_batch: int = 8, wait_ms: int = 25, max_batch_tokens: int = 4000):
+        self.max_batch = max_batch
+        self.wait_seconds = wait_ms / 1000
+        self.max_batch_tokens = max_batch_tokens
+        self._pending: Dict[Any, List[Tuple[List[Dict[str, Any]], Dict[str, Any], asyncio.Future]]] = {}
+        self._flush_handles: Dict[Any, asyncio.TimerHandle] = {}
+        # Strong references to running batches; the event loop only keeps weak ones
+        self._tasks: Set[asyncio.Task] = set()
+
+    async def submit(self, messages: List[Dict[str, Any]], batch_key: Any = None, **kwargs) -> str:
+        """Queue a completion and return its content once the batch is answered"""
+        future = asyncio.get_running_loop().create_future()
+        pending = self._pending.get(batch_key)
+        if pending and self._batch_tokens(pending) + kwargs.get('max_tokens', 1000) > self.max_batch_tokens:
+            self._flush(batch_key)
+        pending = self._pending.setdefault(batch_key, [])
+        pending.append((messages, kwargs, future))
+        if len(pending) >= self.max_batch:
+            self._flush(batch_key)
+        elif batch_key not in self._flush_handles:
+            self._flush_handles[batch_key] = asyncio.get_running_loop().call_later(self.wait_seconds, self._flush, batch_key)
+        return await future
+
+    @staticmethod
+    def _batch_tokens(batch) -> int:
+        return sum(kwargs.get('max_tokens', 1000) for _, kwargs, _ in batch)
+
+    def _flush(self, batch_key: Any = None):
+        handle = self._flush_handles.pop(batch_key, None)
+        if handle is not None:
+            handle.cancel()
+        batch = self._pending.pop(batch_key, None)
+        if batch:
+            task = asyncio.create_task(self._run(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch):
+        answers = {}
+        if len(batch) > 1:
+            try:
+                answers = await self._complete_batch(batch)
+            except Exception as e:
+                print(f"Batched completion failed, sending requests individually: {e}")
+
+        await asyncio.gather(*(
+            self._resolve(future, answers[index]) if index in answers
+            else self._complete_single(messages, kwargs, future)
+            for index, (messages, kwargs, future) in enumerate(batch)
+        ))
+
+    async def _resolve(self, future: asyncio.Future, answer: str):
+        if not future.done():
+            future.set_result(answer)
+
+    async def _complete_single(self, messages, kwargs, future: asyncio.Future):
+        try:
+            response = await get_llm_provider().create_completion(messages=messages, **kwargs)
+            answer = response['choices'][0]['message']['content']
+        except Exception as e:
+            if not future.done():
+                future.set_exception(e)
+            return
+        await self._resolve(future, answer)
+
+    async def _complete_batch(self, batch) -> Dict[int, str]:
+        requests = [{"id": index, "messages": messages} for index, (messages, _, _) in enumerate(batch)]
+        response = await get_llm_provider().create_completion(
+            messages=[
+                {"role": "system", "content": _BATCH_SYSTEM_PROMPT},
+                {"role": "user", "content": orjson.dumps(requests).decode()}
+            ],
+            tools=[],
+            tool_choice=None,
+            max_tokens=self._batch_tokens(batch),
+            temperature=min(kwargs.get('temperature', 0.3) for _, kwargs, _ in batch)
+        )
+        content = response['choices'][0]['message']['content'].strip()
+        # Tolerate a reply wrapped in a markdown code fence
+        if content.startswith("```"):
+            content = content.strip("`").removeprefix("json").strip()
+        answers = orjson.loads(content)["answers"]
+        return {
+            answer["id"]: answer["answer"] for answer in answers
+            if isinstance(answer.get("id"), int) and 0 <= answer["id"] < len(batch) and isinstance(answer.get("answer"), str)
+        }
+
+# Shared batcher for the study-material synthesis calls
+synthesis_batcher = BatchingLLMClient()
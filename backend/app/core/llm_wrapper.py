@@ -1,6 +1,9 @@
 import os
-import json
+import re
+import orjson
+import hashlib
 from openai import AsyncOpenAI
+from cachetools import TTLCache
 from app.core.config import settings
 from app.tools.search_tools import get_study_material, get_study_material_tool
 
@@ -9,22 +12,41 @@ client = None
 if settings.OPENAI_API_KEY and settings.OPENAI_API_KEY != "your_openai_api_key_here":
     client = AsyncOpenAI(api_key=settings.OPENAI_API_KEY)
 
+_MODEL = "gpt-3.5-turbo"
+_STUDY_SYSTEM_PROMPT = "You are a helpful student mentor assistant with access to study materials."
+_CHAT_SYSTEM_PROMPT = "You are a helpful student mentor assistant."
+
+# Exact-match cache of replies keyed by (model, system prompt, normalized message).
+# Only successful completions are stored, never error messages.
+_response_cache = TTLCache(maxsize=2048, ttl=3600)
+
+# Substring match, like the original `keyword in message` checks, compiled into
+# one pattern so a message is scanned once in C
+_STUDY_KEYWORDS = ["study", "learn", "explain", "what is", "help me understand", "exam", "topic", "concept", "algorithm", "syllabus"]
+_STUDY_KEYWORD_PATTERN = re.compile("|".join(map(re.escape, _STUDY_KEYWORDS)))
+
+def _response_cache_key(system_prompt: str, message: str) -> bytes:
+    normalized = " ".join(message.lower().split())
+    return hashlib.blake2b(f"{_MODEL}|{system_prompt}|{normalized}".encode(), digest_size=16).digest()
+
 async def get_llm_response(message: str) -> str:
     # Require API key for production - no mock responses
     if not client:
         raise ValueError("No OpenAI API key configured. Please add your OpenAI API key to the backend/.env file.")
 
     try:
-        # Check if the message might be asking for study materials
-        study_keywords = ["study", "learn", "explain", "what is", "help me understand", "exam", "topic", "concept", "algorithm", "syllabus"]
+        # Simple keyword-based tool calling (basic implementation): check if the
+        # message might be asking for study materials
+        should_use_study_tool = _STUDY_KEYWORD_PATTERN.search(message.lower()) is not None
 
-        # Simple keyword-based tool calling (basic implementation)
-        message_lower = message.lower()
-        should_use_study_tool = any(keyword in message_lower for keyword in study_keywords)
+        cache_key = _response_cache_key(_STUDY_SYSTEM_PROMPT if should_use_study_tool else _CHAT_SYSTEM_PROMPT, message)
+        cached_reply = _response_cache.get(cache_key)
+        if cached_reply is not None:
+            return cached_reply
 
         if should_use_study_tool:
             # Use the study material tool
-            tool_result = get_study_material(message)
+            tool_result = await get_study_material(message)
 
             if tool_result["success"]:
                 # Enhanced prompt with retrieved context
@@ -38,29 +60,33 @@ Study Materials Context:
 Please provide a comprehensive answer based on the study materials above. If the context doesn't fully answer the question, you can supplement with general knowledge but make it clear what comes from the materials vs general knowledge."""
 
                 response = await client.chat.completions.create(
-                    model="gpt-3.5-turbo",
+                    model=_MODEL,
                     messages=[
-                        {"role": "system", "content": "You are a helpful student mentor assistant with access to study materials."},
+                        {"role": "system", "content": _STUDY_SYSTEM_PROMPT},
                         {"role": "user", "content": enhanced_message}
                     ],
                     max_tokens=800,
                     temperature=0.3  # Lower temperature for more factual responses
                 )
-                return response.choices[0].message.content
+                reply = response.choices[0].message.content
+                _response_cache[cache_key] = reply
+                return reply
             else:
                 return f"Sorry, I encountered an error searching study materials: {tool_result.get('error', 'Unknown error')}"
         else:
             # Regular conversation without RAG
             response = await client.chat.completions.create(
-                model="gpt-3.5-turbo",
+                model=_MODEL,
                 messages=[
-                    {"role": "system", "content": "You are a helpful student mentor assistant."},
+                    {"role": "system", "content": _CHAT_SYSTEM_PROMPT},
                     {"role": "user", "content": message}
                 ],
                 max_tokens=500,
                 temperature=0.7
             )
-            return response.choices[0].message.content
+            reply = response.choices[0].message.content
+            _response_cache[cache_key] = reply
+            return reply
 
     except Exception as e:
         return f"Error: {str(e)}"
@@ -94,7 +120,7 @@ async def get_llm_response_with_functions(message: str) -> str:
             tool_call = message.tool_calls[0]
             if tool_call.function.name == "get_study_material":
                 # Parse the tool arguments
-                args = json.loads(tool_call.function.arguments)
+                args = orjson.loads(tool_call.function.arguments)
                 tool_result = get_study_material(args["query"])
 
                 # Send the tool result back to the model
@@ -108,7 +134,7 @@ async def get_llm_response_with_functions(message: str) -> str:
                             "role": "tool",
                             "tool_call_id": tool_call.id,
                             "name": tool_call.function.name,
-                            "content": json.dumps(tool_result)
+                            "content": orjson.dumps(tool_result).decode()
                         }
                     ],
                     max_tokens=800,
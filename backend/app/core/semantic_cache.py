@@ -0,0 +1,72 @@
+"""
+Semantic response cache for StudyRobo
+Serves a stored reply when a new message is a close paraphrase of an earlier one,
+skipping the RAG search and the LLM calls
+"""
+
+from collections import deque
+from typing import Optional, Tuple
+import numpy as np
+from cachetools import TTLCache
+from openai import AsyncOpenAI
+from app.core.config import settings
+
+# Same embedding model as the RAG search, so no second model is involved
+SEMANTIC_CACHE_EMBEDDING_MODEL = "text-embedding-3-small"
+SEMANTIC_CACHE_THRESHOLD = 0.92
+SEMANTIC_CACHE_ENTRIES_PER_KEY = 256
+
+# Only read-only intents are cached. Study answers depend on the user's own
+# documents, so they are keyed per user; career answers are shared.
+_PER_USER_INTENTS = {"study"}
+_SHARED_INTENTS = {"career"}
+
+# (intent, google_id or None) -> deque of (unit embedding, reply)
+_entries = TTLCache(maxsize=10_000, ttl=3600)
+
+_client = AsyncOpenAI(api_key=settings.OPENAI_API_KEY) if settings.OPENAI_API_KEY else None
+
+def cache_key(intent: str, google_id: Optional[str]) -> Optional[Tuple[str, Optional[str]]]:
+    """Return the cache partition for a request, or None if it must not be cached"""
+    if not settings.SEMANTIC_CACHE_ENABLED or _client is None:
+        return None
+    if intent in _PER_USER_INTENTS and google_id:
+        return intent, google_id
+    if intent in _SHARED_INTENTS:
+        return intent, None
+    return None
+
+async def embed(message: str) -> Optional[np.ndarray]:
+    """Embed a message as a unit vector; None if the embedding call fails"""
+    try:
+        response = await _client.embeddings.create(input=message, model=SEMANTIC_CACHE_EMBEDDING_MODEL)
+    except Exception as e:
+        print(f"Semantic cache embedding failed: {e}")
+        return None
+    vector = np.asarray(response.data[0].embedding, dtype=np.float32)
+    return vector / np.linalg.norm(vector)
+
+def lookup(key: Tuple[str, Optional[str]], embedding: np.ndarray) -> Optional[str]:
+    """Return the reply of the most similar cached message above the threshold"""
+    entries = _entries.get(key)
+    if not entries:
+        return None
+    vectors = np.stack([vector for vector, _ in entries])
+    similarities = vectors @ embedding
+    best = int(np.argmax(similarities))
+    if similarities[best] < SEMANTIC_CACHE_THRESHOLD:
+        return None
+    return entries[best][1]
+
+def invalidate(google_id: str):
+    """Forget a user's cached replies, e.g. after their documents changed"""
+    for intent in _PER_USER_INTENTS:
+        _entries.pop((intent, google_id), None)
+
+def store(key: Tuple[str, Optional[str]], embedding: np.ndarray, reply: str):
+    """Remember a reply; the oldest entries of a partition are dropped first"""
+    entries = _entries.get(key)
+    if entries is None:
+        entries = deque(maxlen=SEMANTIC_CACHE_ENTRIES_PER_KEY)
+        _entries[key] = entries
+    entries.append((embedding, reply))
@@ -1,6 +1,8 @@
 import os
-import requests
-from typing import Dict, Any, Optional
+import asyncio
+import httpx
+from functools import lru_cache
+from typing import Dict, Any, Optional, List
 from .config import settings
 
 class SimpleSupabaseClient:
@@ -14,41 +16,68 @@ class SimpleSupabaseClient:
             'Content-Type': 'application/json',
             'apikey': key
         }
+        # Pooled keep-alive HTTP/2 connections so queries reuse TCP+TLS sessions;
+        # async so a query never blocks the event loop
+        self.http = httpx.AsyncClient(
+            headers=self.headers,
+            http2=True,
+            limits=httpx.Limits(max_keepalive_connections=50, max_connections=100),
+            timeout=10.0
+        )
+        self._tables: Dict[str, SupabaseTable] = {}
 
     def table(self, table_name: str):
-        return SupabaseTable(self.url, table_name, self.headers)
+        # Tables hold no per-query state, so one instance per name is shared
+        table = self._tables.get(table_name)
+        if table is None:
+            table = self._tables[table_name] = SupabaseTable(self.url, table_name, self.http)
+        return table
+
+    def rpc(self, function_name: str, params: Dict[str, Any]):
+        return SupabaseRpcQuery(self.url, function_name, self.http, params)
+
+    async def warm_up(self):
+        """Open a pooled connection ahead of the first request."""
+        try:
+            await self.http.head(f"{self.url}/rest/v1/users", params={'select': 'id', 'limit': 1})
+        except httpx.HTTPError as e:
+            print(f"Supabase connection warm-up failed: {e}")
+
+    async def aclose(self):
+        await self.http.aclose()
 
 class SupabaseTable:
     """Simple table operations for Supabase."""
 
-    def __init__(self, base_url: str, table_name: str, headers: Dict[str, str]):
+    def __init__(self, base_url: str, table_name: str, http: httpx.AsyncClient):
         self.base_url = base_url
         self.table_name = table_name
-        self.headers = headers
+        self.http = http
+        # Built once per table; every query on it reuses the same URL
+        self.endpoint = f"{base_url}/rest/v1/{table_name}"
 
     def select(self, columns: str = '*'):
-        return SupabaseQuery(self.base_url, self.table_name, self.headers, columns)
+        return SupabaseQuery(self.endpoint, self.http, columns)
 
     def insert(self, data: Dict[str, Any]):
-        return SupabaseInsertQuery(self.base_url, self.table_name, self.headers, data)
+        return SupabaseInsertQuery(self.endpoint, self.http, data)
 
     def update(self, data: Dict[str, Any]):
-        return SupabaseUpdateQuery(self.base_url, self.table_name, self.headers, data)
+        return SupabaseUpdateQuery(self.endpoint, self.http, data)
 
     def upsert(self, data: Dict[str, Any], **kwargs):
         on_conflict = kwargs.get('onConflict', '')
-        return SupabaseUpsertQuery(self.base_url, self.table_name, self.headers, data, on_conflict)
+        return SupabaseUpsertQuery(self.endpoint, self.http, data, on_conflict)
 
     def rpc(self, function_name: str, params: Dict[str, Any]):
-        return SupabaseRpcQuery(self.base_url, function_name, self.headers, params)
+        return SupabaseRpcQuery(self.base_url, function_name, self.http, params)
 
 class SupabaseQuery:
     """Simple query builder for Supabase."""
 
-    def __init__(self, base_url: str, table_name: str, headers: Dict[str, str], columns: str):
-        self.base_url = base_url
-        self.table_name = table_name
-        self.headers = headers
+    def __init__(self, endpoint: str, http: httpx.AsyncClient, columns: str):
+        self.endpoint = endpoint
+        self.http = http
         self.columns = columns
         self.filters = []
 
@@ -57,14 +86,14 @@ class SupabaseQuery:
         return self
 
     def single(self):
-        return SupabaseSingleQuery(self.base_url, self.table_name, self.headers, self.columns, self.filters)
+        return SupabaseSingleQuery(self.endpoint, self.http, self.columns, self.filters)
 
-    def execute(self):
-        url = f"{self.base_url}/rest/v1/{self.table_name}"
+    async def execute(self):
+        url = self.endpoint
         if self.filters:
             url += "?" + "&".join(self.filters)
 
-        response = requests.get(url, headers=self.headers)
+        response = await self.http.get(url)
         response.raise_for_status()
 
         data = response.json()
@@ -73,19 +102,18 @@ class SupabaseQuery:
 class SupabaseSingleQuery:
     """Single record query for Supabase."""
 
-    def __init__(self, base_url: str, table_name: str, headers: Dict[str, str], columns: str, filters: list):
-        self.base_url = base_url
-        self.table_name = table_name
-        self.headers = headers
+    def __init__(self, endpoint: str, http: httpx.AsyncClient, columns: str, filters: list):
+        self.endpoint = endpoint
+        self.http = http
         self.columns = columns
         self.filters = filters
 
-    def execute(self):
-        url = f"{self.base_url}/rest/v1/{self.table_name}"
+    async def execute(self):
+        url = self.endpoint
         if self.filters:
             url += "?" + "&".join(self.filters)
 
-        response = requests.get(url, headers=self.headers)
+        response = await self.http.get(url)
         response.raise_for_status()
 
         data = response.json()
@@ -99,37 +127,35 @@ class SupabaseSingleQuery:
 class SupabaseInsertQuery:
     """Insert query for Supabase."""
 
-    def __init__(self, base_url: str, table_name: str, headers: Dict[str, str], data: Dict[str, Any]):
-        self.base_url = base_url
-        self.table_name = table_name
-        self.headers = headers
+    def __init__(self, endpoint: str, http: httpx.AsyncClient, data: Dict[str, Any]):
+        self.endpoint = endpoint
+        self.http = http
         self.data = data
 
-    def execute(self):
-        url = f"{self.base_url}/rest/v1/{self.table_name}"
+    async def execute(self):
+        url = self.endpoint
 
         try:
-            response = requests.post(url, headers=self.headers, json=self.data)
+            response = await self.http.post(url, json=self.data)
             response.raise_for_status()
             return {"data": response.json(), "error": None}
-        except requests.exceptions.HTTPError as e:
+        except httpx.HTTPStatusError as e:
             if response.status_code == 409:
                 # Conflict error - return the error details
                 return {"data": None, "error": {"code": 409, "message": response.text}}
             else:
                 # Re-raise other HTTP errors
                 raise
-        except requests.exceptions.RequestException as e:
+        except (httpx.RequestError, ValueError) as e:
             # Handle other request errors
             return {"data": None, "error": {"code": 500, "message": str(e)}}
 
 class SupabaseUpdateQuery:
     """Update query for Supabase."""
 
-    def __init__(self, base_url: str, table_name: str, headers: Dict[str, str], data: Dict[str, Any]):
-        self.base_url = base_url
-        self.table_name = table_name
-        self.headers = headers
+    def __init__(self, endpoint: str, http: httpx.AsyncClient, data: Dict[str, Any]):
+        self.endpoint = endpoint
+        self.http = http
         self.data = data
         self.filters = []
 
@@ -137,39 +163,39 @@ class SupabaseUpdateQuery:
         self.filters.append(f"{column}=eq.{value}")
         return self
 
-    def execute(self):
-        url = f"{self.base_url}/rest/v1/{self.table_name}"
+    async def execute(self):
+        url = self.endpoint
         if self.filters:
             url += "?" + "&".join(self.filters)
 
         try:
-            response = requests.patch(url, headers=self.headers, json=self.data)
+            response = await self.http.patch(url, json=self.data)
             response.raise_for_status()
             return {"data": response.json(), "error": None}
-        except requests.exceptions.HTTPError as e:
+        except httpx.HTTPStatusError as e:
             if response.status_code == 404:
                 # Not found - return empty result
                 return {"data": None, "error": {"code": 404, "message": "Record not found"}}
             else:
                 # Re-raise other HTTP errors
                 raise
-        except requests.exceptions.RequestException as e:
+        except (httpx.RequestError, ValueError) as e:
             # Handle other request errors
             return {"data": None, "error": {"code": 500, "message": str(e)}}
 
 class SupabaseRpcQuery:
     """RPC query for Supabase."""
 
-    def __init__(self, base_url: str, function_name: str, headers: Dict[str, str], params: Dict[str, Any]):
+    def __init__(self, base_url: str, function_name: str, http: httpx.AsyncClient, params: Dict[str, Any]):
         self.base_url = base_url
         self.function_name = function_name
-        self.headers = headers
+        self.http = http
         self.params = params
 
-    def execute(self):
+    async def execute(self):
         url = f"{self.base_url}/rest/v1/rpc/{self.function_name}"
 
-        response = requests.post(url, headers=self.headers, json=self.params)
+        response = await self.http.post(url, json=self.params)
         response.raise_for_status()
 
         return response.json()
@@ -177,23 +203,38 @@ class SupabaseRpcQuery:
 class SupabaseUpsertQuery:
     """Upsert query for Supabase."""
 
-    def __init__(self, base_url: str, table_name: str, headers: Dict[str, str], data: Dict[str, Any], on_conflict: str):
-        self.base_url = base_url
-        self.table_name = table_name
-        self.headers = headers
+    def __init__(self, endpoint: str, http: httpx.AsyncClient, data: Dict[str, Any], on_conflict: str):
+        self.endpoint = endpoint
+        self.http = http
         self.data = data
         self.on_conflict = on_conflict
 
-    def execute(self):
-        url = f"{self.base_url}/rest/v1/{self.table_name}"
+    async def execute(self):
+        url = self.endpoint
         if self.on_conflict:
             url += f"?on_conflict={self.on_conflict}"
 
-        response = requests.post(url, headers=self.headers, json=self.data)
+        # Without merge-duplicates PostgREST rejects conflicting rows with 409
+        headers = {'Prefer': 'resolution=merge-duplicates,return=representation'}
+        response = await self.http.post(url, headers=headers, json=self.data)
         response.raise_for_status()
 
         return {"data": response.json(), "error": None}
 
+async def gather(*queries) -> List[Any]:
+    """
+    Execute independent queries concurrently and return their results in order.
+
+    The queries share the client's HTTP/2 connection, so a handler waits for the
+    slowest query instead of the sum of all of them:
+
+        profile, connections = await gather(
+            supabase.table('users').select('*').eq('google_id', google_id).single(),
+            supabase.table('user_connections').select('*').eq('user_id', google_id)
+        )
+    """
+    return await asyncio.gather(*(query.execute() for query in queries))
+
 # Create simple Supabase clients
 supabase = SimpleSupabaseClient(settings.SUPABASE_URL, settings.SUPABASE_SERVICE_ROLE_KEY)
 supabase_anon = SimpleSupabaseClient(settings.SUPABASE_URL, settings.SUPABASE_ANON_KEY)
@@ -205,7 +246,8 @@ def get_supabase_client():
     return create_client(settings.SUPABASE_URL, settings.SUPABASE_ANON_KEY)
 
 # Service role client for administrative operations
+@lru_cache(maxsize=None)
 def get_supabase_service_client():
-    """Get the official Supabase client with service role key for administrative operations"""
+    """Get the shared official Supabase client with service role key for administrative operations"""
     from supabase import create_client
     return create_client(settings.SUPABASE_URL, settings.SUPABASE_SERVICE_ROLE_KEY)
@@ -0,0 +1,27 @@
+"""
+Google ID to internal user ID resolution shared by the API endpoints
+"""
+
+from cachetools import LRUCache
+from app.core.supabase_client import supabase
+
+# google_id -> users.id never changes for a user, so successful lookups are kept
+# for the life of the process; misses raise and are never cached
+_user_ids = LRUCache(maxsize=10_000)
+
+async def get_user_id(google_id: str) -> int:
+    """
+    Resolve a Google ID to the internal users.id.
+
+    Raises ValueError if no user has that Google ID.
+    """
+    user_id = _user_ids.get(google_id)
+    if user_id is not None:
+        return user_id
+
+    user_info = (await supabase.table('users').select('id').eq('google_id', google_id).single().execute())['data']
+    if not user_info:
+        raise ValueError(f"User with google_id {google_id} not found in database")
+
+    _user_ids[google_id] = user_info['id']
+    return user_info['id']
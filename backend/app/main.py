@@ -1,9 +1,14 @@
+import asyncio
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 from app.api.v1.api import api_router
 from app.core.config import settings
+from app.core.supabase_client import supabase, supabase_anon
+from app.core.db_client import warm_up_pool, close_pool, close_google_http_client
+from app.core.llm_factory import llm_factory
 
-app = FastAPI(title=settings.PROJECT_NAME)
+app = FastAPI(title=settings.PROJECT_NAME, default_response_class=ORJSONResponse)
 
 app.add_middleware(
     CORSMiddleware,
@@ -15,6 +20,20 @@ app.add_middleware(
 
 app.include_router(api_router, prefix=settings.API_V1_STR)
 
+@app.on_event("startup")
+async def warm_up_connections():
+    # Pay the Supabase and Postgres handshakes before the first user request does
+    await asyncio.gather(
+        supabase.warm_up(),
+        asyncio.to_thread(warm_up_pool)
+    )
+
+@app.on_event("shutdown")
+async def close_connections():
+    await asyncio.gather(supabase.aclose(), supabase_anon.aclose(), close_google_http_client())
+    close_pool()
+    await llm_factory.aclose()
+
 @app.get("/")
 async def root():
     return {"message": "StudyRobo API is running"}
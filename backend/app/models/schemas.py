@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import Optional
 
 class ChatRequest(BaseModel):
@@ -6,4 +6,15 @@ class ChatRequest(BaseModel):
     conversation_id: Optional[str] = None
 
 class ChatResponse(BaseModel):
-    reply: str
\ No newline at end of file
+    reply: str
+
+class MarkAttendanceRequest(BaseModel):
+    course_name: str = Field(..., min_length=1)
+
+class SignedUploadRequest(BaseModel):
+    file_name: str = Field(..., min_length=1)
+
+class ProcessDocumentRequest(BaseModel):
+    file_path: str = Field(..., min_length=1)
+    course_name: str = Field(..., min_length=1)
+    original_file_name: str = Field(..., min_length=1)
@@ -4,7 +4,6 @@ Replaces Google Sheets integration with database table storage
 """
 
 import os
-import json
 import asyncio
 from datetime import datetime
 from typing import Dict, Any, List
@@ -1,9 +1,14 @@
 import os
-import json
 import asyncio
+from functools import lru_cache
 from typing import Dict, Any
 import tavily
 
+@lru_cache(maxsize=None)
+def _get_tavily_client(api_key: str) -> tavily.TavilyClient:
+    """Create the Tavily client once per API key instead of on every search"""
+    return tavily.TavilyClient(api_key=api_key)
+
 def get_career_insights(field: str) -> Dict[str, Any]:
     """
     Search for career insights and job market trends using Tavily search API.
@@ -41,7 +46,7 @@ def get_career_insights(field: str) -> Dict[str, Any]:
             }
 
         # Initialize Tavily client
-        tavily_client = tavily.TavilyClient(api_key=tavily_api_key)
+        tavily_client = _get_tavily_client(tavily_api_key)
 
         # Search for career insights
         search_query = f"latest career insights job market trends salary opportunities for {field}"
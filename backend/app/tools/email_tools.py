@@ -1,15 +1,19 @@
 import os
 import json
 import asyncio
+import base64
 from typing import Dict, Any, List
 from google.oauth2.credentials import Credentials
 from google.auth.transport.requests import Request
 from googleapiclient.discovery import build, Resource
 import aiofiles
+from email.mime.text import MIMEText
+from cachetools import TTLCache
 
 # Simple in-memory storage for demo (in production, use a proper database)
 token_store = {}
-_oauth_states = {}  # Store OAuth state parameters for security
+# OAuth state parameters, valid for 10 minutes; abandoned flows expire on their own
+_oauth_states = TTLCache(maxsize=10_000, ttl=600)
 
 async def get_unread_emails(user_id: str = "default") -> Dict[str, Any]:
     """
@@ -176,9 +180,6 @@ async def draft_email(to: str, subject: str, body: str, user_id: str = "default"
 
 def create_message(to: str, subject: str, body: str) -> str:
     """Create a raw email message for Gmail API."""
-    from email.mime.text import MIMEText
-    import base64
-
     message = MIMEText(body)
     message['to'] = to
     message['subject'] = subject
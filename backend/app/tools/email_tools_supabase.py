@@ -4,33 +4,54 @@ Replaces service account authentication with OAuth token-based approach
 """
 
 import os
-import json
 import asyncio
-from typing import Dict, Any, List
+import base64
+import requests
+from typing import Dict, Any, List, Awaitable, Optional
 from google.oauth2.credentials import Credentials
 from google.auth.transport.requests import Request
 from googleapiclient.discovery import build, Resource
 import aiofiles
+from email.mime.text import MIMEText
+from app.core.supabase_client import supabase
 
-async def get_unread_emails(user_id: str, max_results: int = 10) -> Dict[str, Any]:
+# Keep-alive session so token refreshes reuse the TLS connection to Google
+_http_session = requests.Session()
+
+async def get_gmail_connection(user_id: str) -> Optional[Dict[str, Any]]:
+    """
+    Look up the user's stored Gmail connection row.
+
+    Args:
+        user_id (str): User ID (Google ID UUID)
+
+    Returns:
+        Optional[Dict[str, Any]]: The connection row, or None if Gmail is not connected
+    """
+    # Query the user's Gmail connection using Google ID (UUID)
+    response = await supabase.table('user_connections').select('*').eq('user_id', user_id).eq('app_name', 'gmail').single().execute()
+    return response.get('data')
+
+async def get_unread_emails(user_id: str, max_results: int = 10, connection_future: Optional[Awaitable[Optional[Dict[str, Any]]]] = None) -> Dict[str, Any]:
     """
     Fetch unread emails from Gmail using stored refresh token.
 
     Args:
         user_id (str): User ID (Google ID UUID) to look up stored tokens
         max_results (int): Maximum number of emails to fetch (default: 10)
+        connection_future (Awaitable, optional): Pending get_gmail_connection lookup
+            started by the caller, so the database round trip overlaps other work
 
     Returns:
         Dict[str, Any]: Unread emails with metadata
     """
     try:
-        # Get Supabase client to query user_connections table
-        from app.core.supabase_client import supabase
-
-        # Query the user's Gmail connection using Google ID (UUID)
-        response = supabase.table('user_connections').select('*').eq('user_id', user_id).eq('app_name', 'gmail').single().execute()
+        if connection_future is not None:
+            connection = await connection_future
+        else:
+            connection = await get_gmail_connection(user_id)
 
-        if not response.get('data'):
+        if not connection:
             return {
                 "success": False,
                 "error": "Gmail not connected",
@@ -39,14 +60,10 @@ async def get_unread_emails(user_id: str, max_results: int = 10) -> Dict[str, An
                 "auth_required": True
             }
 
-        connection = response['data']
-
         # Get the refresh token (simplified version - in production this would be decrypted)
         refresh_token = connection['refresh_token']
 
         # Exchange refresh token for access token
-        import requests
-
         token_url = "https://oauth2.googleapis.com/token"
         data = {
             "client_id": os.getenv("GOOGLE_CLIENT_ID"),
@@ -55,7 +72,7 @@ async def get_unread_emails(user_id: str, max_results: int = 10) -> Dict[str, An
             "grant_type": "refresh_token"
         }
 
-        token_response = requests.post(token_url, data=data)
+        token_response = _http_session.post(token_url, data=data)
         token_data = token_response.json()
 
         if "error" in token_data:
@@ -216,9 +233,6 @@ async def draft_email(google_access_token: str, to: str, subject: str, body: str
 
 def create_message(to: str, subject: str, body: str) -> str:
     """Create a raw email message for Gmail API."""
-    from email.mime.text import MIMEText
-    import base64
-
     message = MIMEText(body)
     message['to'] = to
     message['subject'] = subject
@@ -228,7 +242,7 @@ def create_message(to: str, subject: str, body: str) -> str:
 
     return raw
 
-def check_gmail_connection(user_id: str) -> Dict[str, Any]:
+async def check_gmail_connection(user_id: str) -> Dict[str, Any]:
     """
     Check if a user has Gmail connected.
 
@@ -239,11 +253,8 @@ def check_gmail_connection(user_id: str) -> Dict[str, Any]:
         Dict[str, Any]: Connection status
     """
     try:
-        # Get Supabase client to query user_connections table
-        from app.core.supabase_client import supabase
-
         # Query the user's Gmail connection using Google ID (UUID)
-        response = supabase.table('user_connections').select('*').eq('user_id', user_id).eq('app_name', 'gmail').single().execute()
+        response = await supabase.table('user_connections').select('*').eq('user_id', user_id).eq('app_name', 'gmail').single().execute()
 
         if not response.get('data'):
             return {
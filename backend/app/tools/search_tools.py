@@ -1,9 +1,14 @@
-from typing import Dict, Any
+import asyncio
+from typing import Dict, Any, List, Optional
 from app.core.db_client import search_documents as db_search_documents
 import openai
 from app.core.config import settings
 
-async def get_study_material(query: str, user_id: str = None) -> Dict[str, Any]:
+# Created once so every search reuses the client's HTTPS connection pool; async so
+# the embedding request never blocks the event loop
+_embedding_client = openai.AsyncOpenAI(api_key=settings.OPENAI_API_KEY) if settings.OPENAI_API_KEY else None
+
+async def get_study_material(query: str, user_id: str = None, query_embedding: Optional[List[float]] = None) -> Dict[str, Any]:
     """
     Search for information about course materials, exam topics, and study guides.
 
@@ -14,6 +19,8 @@ async def get_study_material(query: str, user_id: str = None) -> Dict[str, Any]:
     Args:
         query (str): The student's question or topic they want to study
         user_id (str): The user's Google ID for personalized search (optional)
+        query_embedding (List[float], optional): text-embedding-3-small embedding of the
+            query, if the caller already has one; skips the embedding request
 
     Returns:
         Dict[str, Any]: Search results with context information
@@ -29,15 +36,15 @@ async def get_study_material(query: str, user_id: str = None) -> Dict[str, Any]:
             }
 
         # Create query embedding using OpenAI
-        client = openai.OpenAI(api_key=settings.OPENAI_API_KEY)
-        response = client.embeddings.create(
-            input=query,
-            model="text-embedding-3-small"
-        )
-        query_embedding = response.data[0].embedding
+        if query_embedding is None:
+            response = await _embedding_client.embeddings.create(
+                input=query,
+                model="text-embedding-3-small"
+            )
+            query_embedding = response.data[0].embedding
 
-        # Search using database function with user filtering
-        matches = db_search_documents(query_embedding, match_threshold=0.3, match_count=4, google_id=user_id)
+        # Search using database function with user filtering; psycopg2 blocks, so run it in a worker thread
+        matches = await asyncio.to_thread(db_search_documents, query_embedding, match_threshold=0.3, match_count=4, google_id=user_id)
 
         if not matches or len(matches) == 0:
             return {
@@ -64,6 +71,7 @@ async def get_study_material(query: str, user_id: str = None) -> Dict[str, Any]:
             "success": True,
             "context": context,
             "query": query,
+            "user_id": user_id,
             "message": f"Found {len(matches)} relevant study materials for: {query}"
         }
 
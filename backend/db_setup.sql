@@ -139,7 +139,7 @@ create policy "Service role can manage attendance" on attendance
   for all to service_role using (true);
 
 -- 8. Create indexes for better performance
-create index on documents using ivfflat (embedding vector_cosine_ops);
+create index on documents using hnsw (embedding vector_cosine_ops);
 create index on messages (user_id, created_at);
 create index on attendance (user_id, course_name);
 
@@ -0,0 +1,40 @@
+-- Migration Script for StudyRobo Attendance Stats
+-- Run this in Supabase SQL Editor to aggregate attendance stats server-side
+
+-- 1. Attendance stats for a user, resolved from their Google ID in one query.
+-- The user is resolved once in a CTE and attendance is aggregated per course
+-- and overall. Returns null for unknown users so the API can answer 404.
+drop function if exists get_user_attendance_stats(text);
+
+create or replace function get_user_attendance_stats(
+  p_google_id text
+)
+returns json
+language sql
+stable
+security definer
+as $$
+  with u as (
+    select id from users where google_id = p_google_id
+  ),
+  per_course as (
+    select
+      a.course_name,
+      count(*) as total_attendance,
+      max(a.marked_at)::text as last_marked,
+      array_agg(a.marked_at::date::text order by a.marked_at desc) as attendance_dates
+    from attendance a
+    join u on a.user_id = u.id
+    group by a.course_name
+  )
+  select case when exists (select 1 from u) then
+    json_build_object(
+      'total_attendance', coalesce((select sum(total_attendance) from per_course), 0),
+      'total_courses', (select count(*) from per_course),
+      'courses', coalesce(
+        (select json_agg(per_course order by per_course.course_name) from per_course),
+        '[]'::json
+      )
+    )
+  end;
+$$;
@@ -0,0 +1,40 @@
+-- Migration Script for StudyRobo Conversation Message Counts
+-- Run this in Supabase SQL Editor to keep per-conversation message counts on
+-- the conversations row instead of counting messages on every sidebar load
+
+-- 1. Add the counter column
+alter table conversations
+add column if not exists message_count int not null default 0;
+
+-- 2. Trigger function: bump the owning conversation's count on insert/delete
+create or replace function update_conversation_message_count()
+returns trigger
+language plpgsql
+as $$
+begin
+  if tg_op = 'INSERT' then
+    if new.conversation_id is not null then
+      update conversations set message_count = message_count + 1
+      where id = new.conversation_id;
+    end if;
+  elsif tg_op = 'DELETE' then
+    if old.conversation_id is not null then
+      update conversations set message_count = message_count - 1
+      where id = old.conversation_id;
+    end if;
+  end if;
+  return null;
+end;
+$$;
+
+drop trigger if exists messages_conversation_message_count on messages;
+
+create trigger messages_conversation_message_count
+after insert or delete on messages
+for each row execute function update_conversation_message_count();
+
+-- 3. Backfill counts for existing conversations
+update conversations c
+set message_count = (
+  select count(*) from messages m where m.conversation_id = c.id
+);
@@ -11,7 +11,7 @@ create table conversations (
 
 -- 2. Add conversation_id to messages table
 alter table messages
-add column conversation_id uuid references conversations(id);
+add column conversation_id uuid references conversations(id) on delete cascade;
 
 -- 3. Create indexes for better performance
 create index on conversations (user_id, created_at);
@@ -0,0 +1,15 @@
+-- Migration Script for StudyRobo Document Embedding Index
+-- Run this in Supabase SQL Editor. CONCURRENTLY cannot run inside a transaction
+-- block, so execute each statement on its own. Requires pgvector 0.5.0 or later.
+
+-- search_documents orders by the raw cosine distance and takes the top k, which
+-- lets the planner walk an approximate index instead of scoring every row. The
+-- ivfflat index from db_setup.sql was built on an empty table, so its lists are
+-- untrained and recall is poor; HNSW needs no training data.
+
+-- 1. HNSW index on the document embeddings (cosine distance)
+create index concurrently if not exists documents_embedding_hnsw_idx
+  on documents using hnsw (embedding vector_cosine_ops);
+
+-- 2. Drop the old ivfflat index (default name from db_setup.sql)
+drop index concurrently if exists documents_embedding_idx;
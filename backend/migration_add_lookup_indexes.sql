@@ -0,0 +1,17 @@
+-- Migration Script for StudyRobo Lookup Indexes
+-- Run this in Supabase SQL Editor. CONCURRENTLY cannot run inside a transaction
+-- block, so execute each statement on its own.
+
+-- Fresh installs already get these through the unique constraints in
+-- db_setup.sql and create_user_connections.sql, but databases patched with
+-- quick_fix.sql may have google_id without one. IF NOT EXISTS makes this a
+-- no-op where an index of the same name is already present.
+
+-- 1. users.google_id: resolved on nearly every authenticated request
+create unique index concurrently if not exists idx_users_google_id_unique
+  on users (google_id);
+
+-- 2. user_connections (user_id, app_name): Gmail token lookups and the
+-- upsert conflict target in store_google_tokens
+create unique index concurrently if not exists idx_user_connections_user_app
+  on user_connections (user_id, app_name);
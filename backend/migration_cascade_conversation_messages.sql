@@ -0,0 +1,14 @@
+-- Migration Script for StudyRobo Conversation Message Cascade
+-- Run this in Supabase SQL Editor
+
+-- delete_conversation removes only the conversation row and relies on the
+-- database to remove its messages. Databases set up before the cascade was
+-- added to migration_add_conversations.sql need the foreign key recreated.
+
+-- 1. Recreate messages.conversation_id foreign key with on delete cascade
+alter table messages
+drop constraint if exists messages_conversation_id_fkey;
+
+alter table messages
+add constraint messages_conversation_id_fkey
+  foreign key (conversation_id) references conversations(id) on delete cascade;
@@ -60,7 +60,7 @@ create table attendance (
 );
 
 -- 6. Create indexes for better performance
-create index on documents using ivfflat (embedding vector_cosine_ops);
+create index on documents using hnsw (embedding vector_cosine_ops);
 create index on messages (user_id, created_at);
 create index on attendance (user_id, course_name);
 